@@ -0,0 +1,209 @@
+"""
+Client Benchmark Script
+
+This script compares the lookups per second of the normalizeHours client with naive usage of the server, without calling Azure OpenAI.
+The server is started against the mock completion backend of `loadTest.py` (or an already running server is targeted), and the same workload is run:
+    * naively, with one `urllib` request per lookup, opening a new connection each time,
+    * through `NormalizeHoursClient` from the same number of threads,
+    * through `AsyncNormalizeHoursClient` from as many concurrent asyncio tasks.
+Each run draws its lookups from its own set of input strings, so no run is answered by the server cache warmed by another.
+
+---> OPERATIONAL INSTRUCTIONS <---
+
+Instructions:
+    1) Install the server requirements (`pip install -r ../server/requirements.txt`).
+    2) Run the following command within the terminal: `python clientBenchmark.py --concurrency 16 --lookups 2000 --distinct 500`.
+        a) `--distinct` sets the number of distinct input strings each run draws its lookups from.
+        b) `--mock-latency 0.3 --mock-jitter 0.1` configures the mock backend.
+        c) `--server prefork` starts the production server in `serve.py` instead of the Flask development server.
+        d) `--target http://localhost:8000` drives an already running server instead of starting one (see `loadTest.py`).
+
+Desired Output:
+    * The lookups per second, HTTP calls and errors of each run, and the speedup of the client over naive usage.
+"""
+
+
+# PACKAGE IMPORTS
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# LOCAL FILE IMPORTS
+from normalizeHoursClient import NormalizeHoursClient, AsyncNormalizeHoursClient
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from loadTest import start_mock_backend, random_hours, wait_for_server, MockCompletionHandler, SERVER_DIRECTORY
+
+
+# MISC CONSTANTS
+SEGMENT_COUNTS, SEGMENT_WEIGHTS = [1, 2, 5], [0.6, 0.3, 0.1]
+
+
+
+
+# HELPERS
+def build_workload(
+    lookups: int,
+    distinct: int,
+) -> list:
+    """
+    Returns `lookups` input strings drawn from `distinct` random input strings, so lookups repeat as in a bulk upload file.
+    """
+    cases = [random_hours(random.choices(SEGMENT_COUNTS, SEGMENT_WEIGHTS)[0]) for _ in range(distinct)]
+    return [random.choice(cases) for _ in range(lookups)]
+
+
+def run_threads(
+    workload: list,
+    concurrency: int,
+    lookup: callable,
+) -> tuple:
+    """
+    Runs `lookup` on every input string of the workload from `concurrency` threads, returning the number of failed lookups and the wall time.
+    """
+    remaining = list(reversed(workload))
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker() -> None:
+        while True:
+            with lock:
+                if not remaining:
+                    return
+                case = remaining.pop()
+            try:
+                lookup(case)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    return errors[0], time.perf_counter() - start_time
+
+
+def naive_lookup(
+    target: str,
+) -> callable:
+    """
+    """
+    def lookup(case: str) -> None:
+        with urllib.request.urlopen(target + "/normalizeHours/" + urllib.parse.quote(case, safe=""), timeout=120) as response:
+            response.read()
+    return lookup
+
+
+async def run_async(
+    workload: list,
+    concurrency: int,
+    client: AsyncNormalizeHoursClient,
+) -> tuple:
+    """
+    Looks up every input string of the workload from `concurrency` asyncio tasks, returning the number of failed lookups and the wall time.
+    """
+    remaining = list(reversed(workload))
+    errors = [0]
+
+    async def worker() -> None:
+        while remaining:
+            try:
+                await client.normalize(remaining.pop())
+            except Exception:
+                errors[0] += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return errors[0], time.perf_counter() - start_time
+
+
+def print_run(
+    name: str,
+    lookups: int,
+    errors: int,
+    wall_time: float,
+    calls: int,
+) -> float:
+    """
+    Prints a run's results, and returns its lookups per second.
+    """
+    rate = lookups / wall_time
+    print(f"{name}:\t{rate:8.1f} lookups/s\t{calls:6d} HTTP calls\t{errors} errors\t{wall_time:.2f}s")
+    return rate
+
+
+
+
+# MAIN
+if __name__ == "__main__":
+    # Define console parser
+    parser = argparse.ArgumentParser(description="Compare the normalizeHours client with naive usage of the server, against a mock completion backend")
+    parser.add_argument("--target", action="store", default=None, help="URL of an already running server (default: start a server against the mock backend)")
+    parser.add_argument("--server", action="store", choices=["flask", "prefork"], default="flask", help="Server to start: the Flask development server, or the pre-fork server in serve.py")
+    parser.add_argument("--port", action="store", type=int, default=5000, help="Port of the started server")
+    parser.add_argument("--concurrency", action="store", type=int, default=16, help="Number of concurrent threads or tasks per run")
+    parser.add_argument("--lookups", action="store", type=int, default=2000, help="Number of lookups per run")
+    parser.add_argument("--distinct", action="store", type=int, default=500, help="Number of distinct input strings per run")
+    parser.add_argument("--batch-window", action="store", type=float, default=0.01, help="Batch window of the client, in seconds")
+    parser.add_argument("--mock-port", action="store", type=int, default=0, help="Port of the mock completion backend (default: any free port)")
+    parser.add_argument("--mock-latency", action="store", type=float, default=0.3, help="Mean latency of the mock backend, in seconds")
+    parser.add_argument("--mock-jitter", action="store", type=float, default=0.1, help="Standard deviation of the mock backend latency, in seconds")
+    args = parser.parse_args()
+
+    # Start Mock Backend
+    mock_backend = start_mock_backend(args.mock_port, args.mock_latency, args.mock_jitter, 0.0)
+    mock_url = f"http://127.0.0.1:{mock_backend.server_address[1]}"
+
+    # Start Server
+    server_process = None
+    target = args.target
+    if target is None:
+        environment = dict(os.environ, OAI_BASE=mock_url, OAI_KEY="mock", OAI_ENGINE="mock", CACHE_SNAPSHOT_PATH="", CACHE_WARM_PATHS="", SERVER_BIND=f"127.0.0.1:{args.port}")
+        if args.server == "prefork":
+            command = [sys.executable, "serve.py"]
+        else:
+            command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(args.port), "--with-threads"]
+        server_process = subprocess.Popen(command, cwd=SERVER_DIRECTORY, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        target = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_for_server(target, 30)
+        print(f"Running {args.lookups} lookups of {args.distinct} distinct input strings against {target} from {args.concurrency} clients...")
+        client_options = {"pool_size": args.concurrency, "batch_window_seconds": args.batch_window}
+
+        # Naive Usage
+        workload = build_workload(args.lookups, args.distinct)
+        errors, wall_time = run_threads(workload, args.concurrency, naive_lookup(target))
+        naive_rate = print_run("Naive", len(workload), errors, wall_time, len(workload))
+
+        # Client
+        workload = build_workload(args.lookups, args.distinct)
+        with NormalizeHoursClient(target, **client_options) as client:
+            errors, wall_time = run_threads(workload, args.concurrency, client.normalize)
+            stats = client.stats()
+        client_rate = print_run("Client", len(workload), errors, wall_time, stats["calls"])
+        print(f"\t\t{stats['cacheHits']} cache hits, {stats['coalesced']} coalesced, {stats['connectionsOpened']} connections opened, {stats['connectionsReused']} reused")
+
+        # Async Client
+        async def run_async_client() -> tuple:
+            async with AsyncNormalizeHoursClient(target, **client_options) as client:
+                result = await run_async(workload, args.concurrency, client)
+                return result, client.stats()
+        workload = build_workload(args.lookups, args.distinct)
+        (errors, wall_time), stats = asyncio.run(run_async_client())
+        async_rate = print_run("Async Client", len(workload), errors, wall_time, stats["calls"])
+
+        print(f"Speedup:\t{client_rate / naive_rate:.1f}x (client), {async_rate / naive_rate:.1f}x (async client)")
+        print("Mock Calls:\t" + str(MockCompletionHandler.calls))
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+        mock_backend.shutdown()
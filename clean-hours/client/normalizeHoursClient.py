@@ -0,0 +1,563 @@
+"""
+This module contains the Python client of the normalizeHours server.
+
+Calls reuse keep-alive connections from a bounded pool, and lookups are answered from a client-side LRU cache when the input string was normalized recently.
+Cache misses submitted within a short window of each other are coalesced into one call of the batch endpoint, and concurrent misses for the same input string share one lookup.
+Calls failing with a 429, 502, 503 or 504, or failing to reach the server, are retried with exponential backoff, waiting for the server's `Retry-After` when it sends one.
+
+`NormalizeHoursClient` is used from threads, and `AsyncNormalizeHoursClient` from asyncio. Both only require the standard library.
+
+Example:
+    with NormalizeHoursClient("http://localhost:8000", api_key="...") as client:
+        client.normalize("Monday 9am-11am")
+        client.normalize_many(["Monday 9am-11am", "1st Tuesday 1pm-3pm"])
+"""
+
+
+# PACKAGE IMPORTS
+import asyncio
+import gzip
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# MISC CONSTANTS
+RETRY_STATUSES = {429, 502, 503, 504}
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+API_KEY_HEADER = "X-API-Key"
+
+
+
+
+# ERRORS
+class NormalizeHoursError(Exception):
+    """
+    Raised when the server rejects a call, or cannot be reached once the retries are used up.
+    """
+    def __init__(
+        self,
+        message: str,
+        status: int = None,
+    ) -> None:
+        """
+        """
+        super().__init__(message)
+        self.status = status
+
+
+
+
+# CONNECTION POOL
+class ConnectionPool:
+    """
+    A thread-safe pool of up to `max_size` keep-alive connections to one server.
+    """
+    def __init__(
+        self,
+        base_url: str,
+        max_size: int,
+        timeout: float,
+    ) -> None:
+        """
+        """
+        url = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.path_prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def take(
+        self,
+    ) -> tuple:
+        """
+        Returns an idle connection, or a new one, and whether it was reused.
+        """
+        with self.lock:
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop(), True
+            self.opened += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = None,
+        headers: dict = {},
+        on_line: callable = None,
+    ) -> tuple:
+        """
+        Sends a request, returning the response's status, headers and body.
+        When `on_line` is given, each line of a successful response is passed to it as it arrives instead, and the body returned is empty.
+        A kept-alive connection closed by the server while idle is replaced once, transparently.
+        """
+        with self.slots:
+            while True:
+                connection, reused = self.take()
+                try:
+                    connection.request(method, self.path_prefix + path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    if on_line is not None and response.status < 400:
+                        [on_line(line) for line in iter(response.readline, b"")]
+                        # Reading the empty remainder marks the response closed, so the connection can be reused
+                        data = response.read()
+                    else:
+                        data = response.read()
+                except STALE_CONNECTION_ERRORS:
+                    connection.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    with self.lock:
+                        self.idle.append(connection)
+                return response.status, response.headers, data
+
+    def close(
+        self,
+    ) -> None:
+        """
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        [connection.close() for connection in idle]
+
+
+
+
+# CACHE
+class LRUCache:
+    """
+    A thread-safe, bounded LRU cache with a TTL on each entry.
+    """
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+    ) -> None:
+        """
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(
+        self,
+        key: str,
+    ) -> any:
+        """
+        Returns the cached value for the key, or None if the key is missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(
+        self,
+        key: str,
+        value: any,
+    ) -> None:
+        """
+        """
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(
+        self,
+    ) -> int:
+        """
+        """
+        return len(self.entries)
+
+
+
+
+# CLIENT
+class NormalizeHoursClient:
+    """
+    A thread-safe client of the normalizeHours server.
+
+    Lookups are cached for `cache_ttl_seconds`, and the misses submitted within `batch_window_seconds` of each other are sent together,
+    in batches of up to `batch_max_size` input strings (a window of 0 sends each miss on its own).
+    Responses holding an `error`, and `partial` responses, are returned but not cached.
+    """
+    def __init__(
+        self,
+        base_url: str = "http://localhost:5000",
+        api_key: str = None,
+        pool_size: int = 8,
+        timeout: float = 120.0,
+        cache_size: int = 10000,
+        cache_ttl_seconds: float = 86400.0,
+        batch_window_seconds: float = 0.01,
+        batch_max_size: int = 100,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 30.0,
+    ) -> None:
+        """
+        """
+        self.pool = ConnectionPool(base_url, pool_size, timeout)
+        self.cache = LRUCache(cache_size, cache_ttl_seconds)
+        self.executor = ThreadPoolExecutor(pool_size, thread_name_prefix="normalize-hours-client")
+        self.headers = {API_KEY_HEADER: api_key} if api_key else {}
+        self.batch_window_seconds = batch_window_seconds
+        self.batch_max_size = batch_max_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lock = threading.Lock()
+        self.pending = []
+        self.in_flight = {}
+        self.lookups = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.calls = 0
+        self.batched_items = 0
+        self.retries = 0
+
+    # LOOKUPS
+    def submit(
+        self,
+        case: str,
+    ) -> Future:
+        """
+        Returns a future of the normalized response of the input string, answered from the cache or by the batch the input string joins.
+        """
+        with self.lock:
+            self.lookups += 1
+        response = self.cache.get(case)
+        future = Future()
+        if response is not None:
+            with self.lock:
+                self.cache_hits += 1
+            future.set_result(response)
+            return future
+        batch = None
+        with self.lock:
+            if case in self.in_flight:
+                self.coalesced += 1
+                return self.in_flight[case]
+            self.in_flight[case] = future
+            self.pending.append(case)
+            if self.batch_window_seconds <= 0 or len(self.pending) >= self.batch_max_size:
+                batch = self.take_batch()
+            elif len(self.pending) == 1:
+                # The window timer is started on demand, so no thread exists until the first miss is submitted
+                timer = threading.Timer(self.batch_window_seconds, self.flush)
+                timer.daemon = True
+                timer.start()
+        if batch is not None:
+            self.executor.submit(self.run_batch, batch)
+        return future
+
+    def normalize(
+        self,
+        case: str,
+    ) -> dict:
+        """
+        Returns the normalized response of the input string: its `base`, `formatted` hours and `isValid`.
+        """
+        return self.submit(case).result()
+
+    def normalize_many(
+        self,
+        cases: list,
+    ) -> list:
+        """
+        Returns the normalized responses of a list of input strings, in order, sending the misses without waiting for the batch window.
+        """
+        futures = [self.submit(case) for case in cases]
+        self.flush()
+        return [future.result() for future in futures]
+
+    def validate(
+        self,
+        items: list,
+    ) -> list:
+        """
+        Returns the `{"isValid", "failedRules"}` of each `{"base", "formatted"}` item, validated by the server without calling the model.
+        """
+        return json.loads(self.call("POST", "/validateHours", items))
+
+    # BATCHING
+    def take_batch(
+        self,
+    ) -> list:
+        """
+        Takes every pending input string. Must be called while holding the lock.
+        """
+        batch, self.pending = self.pending, []
+        return batch
+
+    def flush(
+        self,
+    ) -> None:
+        """
+        Sends the pending input strings now, instead of at the end of the batch window.
+        """
+        with self.lock:
+            batch = self.take_batch()
+        if batch:
+            self.executor.submit(self.run_batch, batch)
+
+    def run_batch(
+        self,
+        cases: list,
+    ) -> None:
+        """
+        Looks up a batch of input strings, settling the future of each as soon as its response arrives.
+        """
+        try:
+            self.normalize_batch(cases, self.settle)
+        except BaseException as e:
+            with self.lock:
+                futures = [self.in_flight.pop(case) for case in cases if case in self.in_flight]
+            [future.set_exception(e) for future in futures]
+            return
+        with self.lock:
+            futures = [self.in_flight.pop(case) for case in cases if case in self.in_flight]
+        [future.set_exception(NormalizeHoursError("The server did not return a response for the input string.")) for future in futures]
+
+    def settle(
+        self,
+        response: dict,
+    ) -> None:
+        """
+        Caches a response, unless it holds an `error` or is `partial`, and settles the future of its input string.
+        """
+        case = response.get("base")
+        if "error" not in response and not response.get("partial"):
+            self.cache.set(case, response)
+        with self.lock:
+            future = self.in_flight.pop(case, None)
+        if future is not None:
+            future.set_result(response)
+
+    def normalize_batch(
+        self,
+        cases: list,
+        on_response: callable,
+    ) -> None:
+        """
+        Normalizes a batch of input strings, passing each response to `on_response` as it arrives.
+        A single input string is sent to the single lookup endpoint, unless it holds a `/`, which cannot be sent in a path.
+        """
+        with self.lock:
+            self.batched_items += len(cases)
+        if len(cases) == 1 and "/" not in cases[0]:
+            on_response(dict(json.loads(self.call("GET", "/normalizeHours/" + urllib.parse.quote(cases[0], safe=""))), base=cases[0]))
+            return
+        self.call("POST", "/normalizeHours/batch", cases, lambda line: on_response(json.loads(line)) if line.strip() else None)
+
+    # CALLS
+    def call(
+        self,
+        method: str,
+        path: str,
+        body: any = None,
+        on_line: callable = None,
+    ) -> bytes:
+        """
+        Sends a call to the server, retrying the retryable failures, and returns the response body.
+        A streamed response is passed to `on_line` line by line instead, uncompressed so each line is handled as soon as it arrives.
+        """
+        headers = dict(self.headers, **({} if on_line else {"Accept-Encoding": "gzip"}))
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(self.max_retries + 1):
+            with self.lock:
+                self.calls += 1
+            try:
+                status, response_headers, data = self.pool.request(method, path, body, headers, on_line)
+            except (OSError, http.client.HTTPException) as e:
+                error, retry_after = NormalizeHoursError(f"Could not reach the server: {e}"), None
+            else:
+                if response_headers.get("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+                if status < 400:
+                    return data
+                error, retry_after = NormalizeHoursError(error_message(status, data), status), response_headers.get("Retry-After")
+                if status not in RETRY_STATUSES:
+                    raise error
+            if attempt == self.max_retries:
+                raise error
+            with self.lock:
+                self.retries += 1
+            time.sleep(self.retry_delay(attempt, retry_after))
+
+    def retry_delay(
+        self,
+        attempt: int,
+        retry_after: str = None,
+    ) -> float:
+        """
+        Returns the seconds to wait before a retry: the server's `Retry-After`, or an exponential backoff with full jitter, up to `max_backoff_seconds`.
+        """
+        try:
+            return min(max(0.0, float(retry_after)), self.max_backoff_seconds)
+        except (TypeError, ValueError):
+            return random.uniform(0, min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds))
+
+    # LIFECYCLE
+    def stats(
+        self,
+    ) -> dict:
+        """
+        """
+        with self.lock:
+            return {
+                "lookups": self.lookups,
+                "cacheHits": self.cache_hits,
+                "coalesced": self.coalesced,
+                "batchedItems": self.batched_items,
+                "calls": self.calls,
+                "retries": self.retries,
+                "connectionsOpened": self.pool.opened,
+                "connectionsReused": self.pool.reused,
+                "cacheEntries": len(self.cache),
+            }
+
+    def close(
+        self,
+    ) -> None:
+        """
+        Sends the pending input strings, waits for the calls in progress and closes the idle connections.
+        """
+        self.flush()
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    def __enter__(
+        self,
+    ) -> "NormalizeHoursClient":
+        """
+        """
+        return self
+
+    def __exit__(
+        self,
+        *_: any,
+    ) -> None:
+        """
+        """
+        self.close()
+
+
+
+
+class AsyncNormalizeHoursClient:
+    """
+    The asyncio interface of the client, taking the same arguments as `NormalizeHoursClient`.
+    Calls run on the client's threads, so the event loop is never blocked, and lookups from both interfaces share one cache and batches.
+    """
+    def __init__(
+        self,
+        *args: any,
+        **kwargs: any,
+    ) -> None:
+        """
+        """
+        self.client = NormalizeHoursClient(*args, **kwargs)
+
+    async def normalize(
+        self,
+        case: str,
+    ) -> dict:
+        """
+        """
+        return await asyncio.wrap_future(self.client.submit(case))
+
+    async def normalize_many(
+        self,
+        cases: list,
+    ) -> list:
+        """
+        """
+        futures = [asyncio.wrap_future(self.client.submit(case)) for case in cases]
+        self.client.flush()
+        return list(await asyncio.gather(*futures))
+
+    async def validate(
+        self,
+        items: list,
+    ) -> list:
+        """
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.client.executor, self.client.validate, items)
+
+    def stats(
+        self,
+    ) -> dict:
+        """
+        """
+        return self.client.stats()
+
+    async def close(
+        self,
+    ) -> None:
+        """
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.client.close)
+
+    async def __aenter__(
+        self,
+    ) -> "AsyncNormalizeHoursClient":
+        """
+        """
+        return self
+
+    async def __aexit__(
+        self,
+        *_: any,
+    ) -> None:
+        """
+        """
+        await self.close()
+
+
+
+
+# HELPERS
+def error_message(
+    status: int,
+    data: bytes,
+) -> str:
+    """
+    Returns the `Error` of a failed response's JSON body, or its raw body.
+    """
+    try:
+        return f"{status}: {json.loads(data)['Error']}"
+    except (ValueError, KeyError, TypeError):
+        return f"{status}: {data.decode(errors='replace')[0:200]}"
@@ -0,0 +1,469 @@
+"""
+Hours Validation
+
+This module contains the validation rules shared by the clean hours script and the normalizeHours server.
+
+A formatted hour string holds one or more `;` separated entries of 14 `,` separated fields:
+    Day, Open, Close, -, -, -, -, Information, Week of Month, Day of Month, Hour Type, -, -, -
+Most entries are valid, so each entry is first matched against `VALID_ENTRY_REGEX`, compiled once at import, which checks its format, day, times and hour type in C.
+An entry that matches only needs its close time compared to its open time, and its ordinal looked up in the original hour string.
+An entry that does not match is parsed once into typed fields (the day index, the open and close minute of the day, and the hour type),
+and checked against every rule, cheapest rule first, to find out which rules it fails.
+Times are looked up in a table of every valid `H:MM`/`HH:MM` value built at import, instead of being parsed with `strptime`.
+
+The rules keep the names of the validation tests they replace, so failures are reported (and counted in metrics) under the same names.
+
+The input rules reject an original hour string before it is sent to the model: an empty (or "nan") string, a run-on segment,
+characters that do not occur in written hours, or content that mentions no day, time or other hours wording.
+
+---> OPERATIONAL INSTRUCTIONS <---
+
+Instructions:
+    1) Run the following command within the terminal to benchmark the rules: `python hoursValidation.py --entries 100000`.
+
+Desired Output:
+    * The number of formatted hour strings validated per second, and the time spent per entry.
+"""
+
+
+# PACKAGE IMPORTS
+import argparse
+import random
+import re
+import time
+from enum import Enum
+from typing import NamedTuple
+
+
+# MISC CONSTANTS
+INT_TO_DAY_OF_MONTH = {"1": ["1st", "First"], "2": ["2nd", "Second"], "3": ["3rd", "Third"], "4": ["4th", "Fourth"], "5": ["5th", "Fifth"], "": ""}
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DAY_ABBREVIATIONS = {"mon": "Monday", "tue": "Tuesday", "tues": "Tuesday", "wed": "Wednesday", "thu": "Thursday", "thur": "Thursday", "thurs": "Thursday", "fri": "Friday", "sat": "Saturday", "sun": "Sunday"}
+HOUR_TYPES = ["Weekly", "Every Other Week", "Day of Month", "Week of Month", "Call for Information"]
+ENTRY_FIELDS = 14
+DAY_INDEX = {day: index for index, day in enumerate(DAYS_OF_WEEK)}
+ORDINALS = {number: [ordinal.lower() for ordinal in ordinals] for number, ordinals in INT_TO_DAY_OF_MONTH.items() if number}
+TIME_TO_MINUTE = {f"{hour:02d}:{minute:02d}": hour * 60 + minute for hour in range(24) for minute in range(60)}
+TIME_TO_MINUTE.update({f"{hour}:{minute:02d}": hour * 60 + minute for hour in range(10) for minute in range(60)})
+TIME_PATTERN = r"(?:[01]?[0-9]|2[0-3]):[0-5][0-9]"
+VALID_ENTRY_REGEX = re.compile(
+    r"(?:" + "|".join(DAYS_OF_WEEK) + r"),(" + TIME_PATTERN + r"),(" + TIME_PATTERN + r"),,,,,[^,]*,"
+    r"(?:,,(?:Weekly|Every Other Week)|,([1-5]),Day of Month|([1-5]),,Week of Month),,,"
+    r"|,,,,,,,[^,]*,,,Call for Information,,,"
+)
+EMPTY = None
+INVALID = -1
+EMPTY_CASE_VALUES = ["", "nan", "none", "null", "n/a"]
+# Characters that do not occur in written hours: "%" collides with the model's "%%" stop sequence, "{" and "}" with the template placeholders,
+# and the others mark pasted markup or code
+INVALID_CHARACTERS = "%{}<>|\\^`"
+MAX_SEGMENT_LENGTH = 100
+HOURS_CONTENT_REGEX = re.compile(
+    r"\d|\b(" + "|".join(DAYS_OF_WEEK + list(DAY_ABBREVIATIONS.keys())) + r"|daily|everyday|weekdays?|weekends?|week|month|noon|midnight|morning|afternoon|evening|call|phone|appointment|appt|information)\b",
+    re.IGNORECASE
+)
+
+
+
+
+# TYPES
+class HourType(Enum):
+    """
+    """
+    WEEKLY = "Weekly"
+    EVERY_OTHER_WEEK = "Every Other Week"
+    DAY_OF_MONTH = "Day of Month"
+    WEEK_OF_MONTH = "Week of Month"
+    CALL_FOR_INFORMATION = "Call for Information"
+
+
+HOUR_TYPE_BY_NAME = {hour_type.value: hour_type for hour_type in HourType}
+
+
+class Entry(NamedTuple):
+    """
+    A formatted hour entry parsed into typed fields.
+    The day is `EMPTY` when blank and `INVALID` when not a day of the week, and so are the open and close minutes for times.
+    The hour type is `None` when not one of `HOUR_TYPES`.
+    """
+    fields: list
+    day: int
+    open_minute: int
+    close_minute: int
+    hour_type: HourType
+
+
+
+
+# PARSING
+def parse_time(
+    value: str,
+) -> int:
+    """
+    """
+    if not value:
+        return EMPTY
+    return TIME_TO_MINUTE.get(value, INVALID)
+
+
+def parse_entry(
+    value: str,
+) -> Entry:
+    """
+    Returns the typed fields of a formatted hour entry, or None if the entry does not have exactly `ENTRY_FIELDS` fields.
+    """
+    fields = value.split(",")
+    if len(fields) != ENTRY_FIELDS:
+        return None
+    day, open_time, close_time = fields[0], fields[1], fields[2]
+    # `parse_time` is inlined, as every entry failing the pattern is parsed
+    return Entry(
+        fields,
+        DAY_INDEX.get(day, INVALID) if day else EMPTY,
+        TIME_TO_MINUTE.get(open_time, INVALID) if open_time else EMPTY,
+        TIME_TO_MINUTE.get(close_time, INVALID) if close_time else EMPTY,
+        HOUR_TYPE_BY_NAME.get(fields[10]),
+    )
+
+
+
+
+# RULES
+def is_valid_hour_type(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    """
+    return entry.hour_type is not None
+
+
+def is_null_values_empty(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    """
+    fields = entry.fields
+    return not (fields[3] or fields[4] or fields[5] or fields[6] or fields[11] or fields[12] or fields[13])
+
+
+def is_valid_day_of_week(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    """
+    if entry.day is EMPTY:
+        return entry.hour_type is HourType.CALL_FOR_INFORMATION
+    return entry.day != INVALID
+
+
+def is_valid_weekly_formatting(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    """
+    if entry.hour_type is HourType.WEEKLY or entry.hour_type is HourType.EVERY_OTHER_WEEK:
+        return not entry.fields[8] and not entry.fields[9]
+    return True
+
+
+def is_valid_call_for_information_formatting(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    """
+    if entry.hour_type is HourType.CALL_FOR_INFORMATION:
+        return not "".join(entry.fields[:7]) and not entry.fields[8] and not entry.fields[9] and not "".join(entry.fields[11:])
+    return True
+
+
+def is_valid_open_closed_hours(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    """
+    if entry.hour_type is HourType.CALL_FOR_INFORMATION:
+        return True
+    return entry.open_minute != INVALID and entry.close_minute != INVALID
+
+
+def is_close_hour_greater_than_open_hour(
+    entry: Entry,
+    _: str,
+) -> bool:
+    """
+    Entries without both times are only valid for `Call for Information`.
+    """
+    if entry.open_minute is EMPTY or entry.close_minute is EMPTY or entry.open_minute == INVALID or entry.close_minute == INVALID:
+        return entry.hour_type is HourType.CALL_FOR_INFORMATION
+    return entry.close_minute > entry.open_minute
+
+
+def is_ordinal_in_original(
+    number: str,
+    original: str,
+) -> bool:
+    """
+    Returns whether the original hour string mentions the ordinal of a week or day of month, such as `3rd` or `third` for `3`.
+    """
+    for ordinal in ORDINALS.get(number, ()):
+        if ordinal in original:
+            return True
+    return False
+
+
+def is_valid_day_of_month_formatting(
+    entry: Entry,
+    original: str,
+) -> bool:
+    """
+    """
+    if entry.hour_type is HourType.DAY_OF_MONTH:
+        return entry.fields[9].isdigit() and not entry.fields[8] and is_ordinal_in_original(entry.fields[9], original)
+    return True
+
+
+def is_valid_week_of_month_formatting(
+    entry: Entry,
+    original: str,
+) -> bool:
+    """
+    """
+    if entry.hour_type is HourType.WEEK_OF_MONTH:
+        return entry.fields[8].isdigit() and not entry.fields[9] and is_ordinal_in_original(entry.fields[8], original)
+    return True
+
+
+# Rules checked against every parsed entry, cheapest first. The entry format is checked while parsing.
+# The original hour string is lowercased once, for the rules that search it.
+RULES = [
+    ("test_valid_hour_types", is_valid_hour_type),
+    ("test_valid_day_of_week", is_valid_day_of_week),
+    ("test_weekly_formatting", is_valid_weekly_formatting),
+    ("test_all_null_values_empty_string", is_null_values_empty),
+    ("test_call_for_information_formatting", is_valid_call_for_information_formatting),
+    ("test_valid_open_closed_hours", is_valid_open_closed_hours),
+    ("test_close_hour_greater_than_open_hour", is_close_hour_greater_than_open_hour),
+    ("test_day_of_month_formatting", is_valid_day_of_month_formatting),
+    ("test_week_of_month_formatting", is_valid_week_of_month_formatting),
+]
+ENTRY_FORMAT_RULE = "test_valid_entry_format"
+RULE_NAMES = [ENTRY_FORMAT_RULE] + [name for name, _ in RULES]
+
+# Rules that only depend on the entry itself, so an entry failing one makes any hour string holding it invalid, whatever its original string
+ENTRY_RULE_NAMES = [name for name in RULE_NAMES if name not in ["test_day_of_month_formatting", "test_week_of_month_formatting"]]
+
+
+
+
+# INPUT RULES
+def is_input_not_empty(
+    case: str,
+) -> bool:
+    """
+    """
+    return case.strip().lower() not in EMPTY_CASE_VALUES
+
+
+def is_input_segment_length_valid(
+    case: str,
+) -> bool:
+    """
+    Schedules of many days are long, but each of their `;` separated segments is short, so only run-on segments are rejected.
+    """
+    return all(len(segment.strip()) < MAX_SEGMENT_LENGTH for segment in case.split(";"))
+
+
+def is_input_characters_valid(
+    case: str,
+) -> bool:
+    """
+    """
+    return not any(character in case for character in INVALID_CHARACTERS)
+
+
+def is_input_hours_content(
+    case: str,
+) -> bool:
+    """
+    """
+    return HOURS_CONTENT_REGEX.search(case) is not None
+
+
+# Rules checked against an original hour string before it is sent to the model, cheapest first
+INPUT_RULES = [
+    ("test_valid_case_not_empty", is_input_not_empty),
+    ("test_valid_case_length", is_input_segment_length_valid),
+    ("test_valid_case_characters", is_input_characters_valid),
+    ("test_valid_case_contains_hours", is_input_hours_content),
+]
+INPUT_RULE_NAMES = [name for name, _ in INPUT_RULES]
+
+
+
+
+# VALIDATION
+def find_rejected_input_rules(
+    case: str,
+    early_exit: bool = False,
+) -> list:
+    """
+    Returns the names of the input rules failed by an original hour string, in the order of `INPUT_RULE_NAMES`. An empty list indicates an input worth sending to the model.
+    With `early_exit`, stops at the first failure and returns only that rule.
+    """
+    failed = []
+    for name, rule in INPUT_RULES:
+        if not rule(case):
+            if early_exit:
+                return [name]
+            failed.append(name)
+    return failed
+
+
+def well_formed_ordinal(
+    value: str,
+) -> str:
+    """
+    Returns the week or day of month number an entry needs its original hour string to mention ("" if none), if the entry passes every other rule.
+    Returns None if it does not, leaving the rules to find the failures. The format, day, times and hour type are checked by a single `VALID_ENTRY_REGEX` match.
+    """
+    match = VALID_ENTRY_REGEX.fullmatch(value)
+    if match is None:
+        return None
+    open_time, close_time, day_of_month, week_of_month = match.groups()
+    if open_time is not None and TIME_TO_MINUTE[close_time] <= TIME_TO_MINUTE[open_time]:
+        return None
+    return day_of_month or week_of_month or ""
+
+
+def find_failed_rules(
+    original: str,
+    formatted: str,
+    early_exit: bool = False,
+    rule_names: list = None,
+    ordinals: dict = None,
+    rule_hook: callable = None,
+) -> list:
+    """
+    Returns the names of the rules failed by any entry of a formatted hour string, in the order of `RULE_NAMES`. An empty list indicates a valid string.
+    With `early_exit`, stops at the first failure and returns only that rule. `rule_names` restricts the rules that are checked.
+    An entry without exactly `ENTRY_FIELDS` fields fails `test_valid_entry_format`, and is not checked against the other rules.
+    `ordinals` memoizes `well_formed_ordinal` by entry, for callers validating many strings that share entries.
+    `rule_hook(name, check)` checks the rules one at a time instead, in the order of `RULE_NAMES`, such as to trace each rule.
+    It must return `check()`, whether every entry passes the rule, so the first failure found with `early_exit` is the first failing rule in that order.
+    """
+    if rule_hook is not None:
+        failed = []
+        for name in [name for name in RULE_NAMES if rule_names is None or name in rule_names]:
+            if not rule_hook(name, lambda name=name: not find_failed_rules(original, formatted, rule_names=[name], ordinals=ordinals)):
+                if early_exit:
+                    return [name]
+                failed.append(name)
+        return failed
+    rules = RULES if rule_names is None else [(name, rule) for name, rule in RULES if name in rule_names]
+    check_format = rule_names is None or ENTRY_FORMAT_RULE in rule_names
+    original = original.lower()
+    failed = None
+    for value in formatted.split(";"):
+        if ordinals is None:
+            number = well_formed_ordinal(value)
+        elif value in ordinals:
+            number = ordinals[value]
+        else:
+            number = ordinals[value] = well_formed_ordinal(value)
+        if number == "" or (number is not None and is_ordinal_in_original(number, original)):
+            continue
+        entry = parse_entry(value)
+        if entry is None:
+            if check_format:
+                if early_exit:
+                    return [ENTRY_FORMAT_RULE]
+                failed = failed or set()
+                failed.add(ENTRY_FORMAT_RULE)
+            continue
+        if early_exit:
+            # The first rule the entry fails is the answer, so the failed set is not needed
+            for name, rule in rules:
+                if not rule(entry, original):
+                    return [name]
+            continue
+        failed = failed or set()
+        for name, rule in rules:
+            if name not in failed and not rule(entry, original):
+                failed.add(name)
+    if not failed:
+        return []
+    return [name for name in RULE_NAMES if name in failed]
+
+
+def find_failed_rules_batch(
+    pairs: list,
+    early_exit: bool = False,
+) -> list:
+    """
+    Returns the failed rules of each `(original, formatted)` pair of a batch, in order.
+    Each distinct pair is validated once, and each distinct entry is matched once, however many strings of the batch share it.
+    """
+    ordinals, results = {}, {}
+    failed_rules = []
+    for pair in pairs:
+        failed = results.get(pair)
+        if failed is None:
+            failed = results[pair] = find_failed_rules(pair[0], pair[1], early_exit, ordinals=ordinals)
+        failed_rules.append(failed)
+    return failed_rules
+
+
+def sample_formatted_hours(
+    count: int,
+) -> list:
+    """
+    Returns `count` random (original, formatted) hour string pairs of one to three entries, covering every hour type.
+    """
+    samples = []
+    for _ in range(count):
+        original, entries = [], []
+        for _ in range(random.choice([1, 1, 2, 3])):
+            day = random.choice(DAYS_OF_WEEK)
+            open_hour = random.randint(6, 14)
+            close_hour = open_hour + random.randint(1, 6)
+            hour_type = random.choice(HOUR_TYPES)
+            ordinal = str(random.randint(1, 5))
+            week, day_of_month, info = "", "", ""
+            if hour_type == "Week of Month":
+                week = ordinal
+            elif hour_type == "Day of Month":
+                day_of_month = ordinal
+            if hour_type == "Call for Information":
+                original.append("Call for information")
+                entries.append(",,,,,,,Call ahead,,,Call for Information,,,")
+                continue
+            original.append(f"{INT_TO_DAY_OF_MONTH[ordinal][0]} {day}, {open_hour}am-{close_hour}pm")
+            entries.append(f"{day},{open_hour}:00,{close_hour}:30,,,,,{info},{week},{day_of_month},{hour_type},,,")
+        samples.append(("; ".join(original), ";".join(entries)))
+    return samples
+
+
+
+
+# MAIN
+if __name__ == "__main__":
+    # Define console parser
+    parser = argparse.ArgumentParser(description="Benchmark the hours validation rules")
+    # Add entries argument
+    parser.add_argument("--entries", action="store", type=int, default=100000, help="The number of formatted hour strings to validate")
+    # Console arguments
+    args = parser.parse_args()
+
+    samples = sample_formatted_hours(args.entries)
+    entries = sum(formatted.count(";") + 1 for _, formatted in samples)
+    started_at = time.perf_counter()
+    failures = sum(1 for original, formatted in samples if find_failed_rules(original, formatted, early_exit=True))
+    elapsed = time.perf_counter() - started_at
+    print(f"Validated {len(samples)} hour strings ({entries} entries, {failures} invalid) in {elapsed:.3f}s")
+    print(f"{len(samples) / elapsed:.0f} strings/s, {elapsed / entries * 1e6:.2f} us per entry")
@@ -15,7 +15,8 @@ Finally, the hours are unflattened and reformatted back into the Bulk Upload Fil
 
 Package Imports:
     * OpenAI            * Pandas            * Datetime
-    * Argparse          * Regex
+    * Argparse          * Regex             * Glob
+    * Threading         * Concurrent Futures
 
 API Keys (stored in keys.py):
     * Azure OpenAI - North Central US: Contact Arman for API Key.
@@ -33,36 +34,59 @@ Instructions:
         b) Paste all unformatted/uncleaned hours into this column. Ensure these unformatted hours are in the row with the associating Pantry/Location. Save these changes.
         c) Add the Bulk Upload File to the working directory at the same level as `clean_hours.py`.
     4) Run the following command within the terminal: `python clean_hours.py "{path to Bulk Upload File from working directory}"`.
+        a) Several Bulk Upload Files can be cleaned in one run by passing multiple paths, a directory, or a glob pattern. Ex. `python clean_hours.py "uploads/*.csv" --workers 8`.
+        b) Files cleaned in one run share their OAI calls, so hours repeated across files are only sent to the model once.
 
 Desired Output:
-    * A new CSV file will be present within the working directory, with the name ending in "_HOURS_CLEANED".
+    * A new CSV file will be present within the working directory for each Bulk Upload File, with the name ending in "_HOURS_CLEANED".
     * The file will contain the hours for each pantry cleaned and formatted into their respective rows.
     * Any hours that failed the testing round will remain in the `Hours Uncleaned` column for manual review.
 
+Library Usage:
+    * Other services can clean hours in-process, without writing a Bulk Upload File, using `clean_hours_stream`.
+        >>> from clean_hours import clean_hours_stream
+        >>> for program_id, formatted, is_valid, failed_tests in clean_hours_stream([("ID1", "Every Monday, from 3pm-5pm")]):
+        ...     print(program_id, formatted, is_valid, failed_tests)
+    * Model responses are logged at the INFO level of the `clean_hours` logger, which the script prints and which is silent by default in-process.
+        >>> logging.getLogger("clean_hours").setLevel(logging.INFO)     # Show model responses in-process
+
 Still have questions? Send an email to `arman@vivery.org` with the subject line `Clean Hours - {question}`.
 """
 
 
 # PACKAGE IMPORTS
 import openai
-import argparse, os, shutil
+import argparse, os, shutil, sys
 import pandas as pd
 import re
-from datetime import datetime
 import time
+import glob
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 
 # LOCAL FILE IMPORTS
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from hoursValidation import find_failed_rules, is_input_not_empty, is_input_segment_length_valid, is_input_characters_valid, is_input_hours_content, DAYS_OF_WEEK, DAY_ABBREVIATIONS
 
 
 # AI CONSTANTS
 from keys import CLEAN_HOURS_KEY as OAI_API
 
 # MISC CONSTANTS
-INT_TO_DAY_OF_MONTH = {"1": ["1st", "First"], "2": ["2nd", "Second"], "3": ["3rd", "Third"], "4": ["4th", "Fourth"], "5": ["5th", "Fifth"], "": ""}
-DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-HOUR_TYPES = ["Weekly", "Every Other Week", "Day of Month", "Week of Month", "Call for Information"]
 UNCLEANED_HOURS_COLUMN = "Hours Uncleaned"
-INVALID_CHARACTERS = ""
+LOGGER = logging.getLogger("clean_hours")
+TEMPLATE_REGEX = re.compile(
+    r"\b(?P<day>" + "|".join(DAYS_OF_WEEK + list(DAY_ABBREVIATIONS.keys())) + r")\b"
+    r"|\b(?P<hour>1[0-2]|0?[1-9])(?::(?P<minute>[0-5][0-9]))?\s*(?P<meridiem>am|pm|a\.m\.|p\.m\.)"
+    r"|\b(?P<clock_hour>[01]?[0-9]|2[0-3]):(?P<clock_minute>[0-5][0-9])\b",
+    re.IGNORECASE
+)
+OAI_REQUEST_INTERVAL = 0.05
+OAI_RATE_LIMIT_LOCK = threading.Lock()
+next_oai_request_time = 0.0
+DAY_PLACEHOLDER = "{DAY}"
+TIME_PLACEHOLDER = "{TIME}"
 
 
 
@@ -105,6 +129,35 @@ def create_id_hours_dict(df: pd.DataFrame) -> dict:
     return id_hours_dict
 
 
+def wait_for_rate_limit() -> None:
+    """
+    Blocks until the next OAI call is allowed to start, spacing calls from every thread at least `OAI_REQUEST_INTERVAL` seconds apart.
+
+    Args:
+        - None
+
+    Preconditions:
+        - None
+
+    Returns:
+        - None
+
+    Raises:
+        - None
+
+    Example:
+        >>> wait_for_rate_limit()    # Returns immediately
+        >>> wait_for_rate_limit()    # Returns after 0.05 seconds
+    """
+    global next_oai_request_time
+    with OAI_RATE_LIMIT_LOCK:
+        now = time.monotonic()
+        wait_time = next_oai_request_time - now
+        next_oai_request_time = max(now, next_oai_request_time) + OAI_REQUEST_INTERVAL
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+
 def call_oai(prompt: str) -> str:
     """
     Calls the `Vivery Clean Hours Training Model` to format uncleaned hours into "bulk-upload-ready" hour entries. 
@@ -139,6 +192,7 @@ def call_oai(prompt: str) -> str:
     openai.api_base = OAI_API["base"]
     openai.api_version = "2023-09-15-preview"
     openai.api_key = OAI_API["key"]
+    wait_for_rate_limit()
     response = openai.Completion.create(
         engine=OAI_API["engine"],
         prompt=f"{prompt}",
@@ -150,8 +204,7 @@ def call_oai(prompt: str) -> str:
         best_of=1,
         stop=["%%"]
     )
-    time.sleep(0.05)
-    print("\tOAI API Response: " + response["choices"][0]["text"])
+    LOGGER.info("\tOAI API Response: " + response["choices"][0]["text"])
     return response["choices"][0]["text"]
 
 
@@ -159,6 +212,8 @@ def postprocess_string(case: str) -> str:
     """
     """
     case = case.split(",")
+    if len(case) < 11:
+        return ",".join(case)
     if case[7] != "" and "".join(case[0:7]) == "" and "".join(case[8:]) == "":
         case[10] = "Call for Information"
     if case[7] == "For information":
@@ -172,12 +227,328 @@ def preprocess_string(case: str) -> str:
     return case.strip().replace("/", ", ")
 
 
-def format_hours_iteratively(id_hours_dict: dict) -> dict:
+def extract_template(case: str) -> tuple:
+    """
+    Abstracts a preprocessed hour segment into its template shape, replacing each day name and time with a placeholder.
+
+    Args:
+        - `case` (str): A single, preprocessed hour segment.
+
+    Preconditions:
+        - The `case` should be a string that has already been passed through `preprocess_string`.
+
+    Returns:
+        - tuple: The template shape (str), the days found in the segment (tuple of full day names), and the times found in the segment (tuple of "H:MM" 24-hour strings).
+
+    Raises:
+        - None
+
+    Example:
+        >>> extract_template("Tuesday 9am-11am")
+        ('{DAY} {TIME}-{TIME}', ('Tuesday',), ('9:00', '11:00'))
+        >>> extract_template("Thursday 1pm-3pm")
+        ('{DAY} {TIME}-{TIME}', ('Thursday',), ('13:00', '15:00'))
+    """
+    days = []
+    times = []
+
+    def replace_match(match: re.Match) -> str:
+        if match.group("day"):
+            day = match.group("day").lower()
+            days.append(DAY_ABBREVIATIONS.get(day, day.capitalize()))
+            return DAY_PLACEHOLDER
+        if match.group("hour"):
+            hour = int(match.group("hour")) % 12 + (12 if match.group("meridiem").lower().startswith("p") else 0)
+            minute = match.group("minute") or "00"
+        else:
+            hour = int(match.group("clock_hour"))
+            minute = match.group("clock_minute")
+        times.append(f"{hour}:{minute}")
+        return TIME_PLACEHOLDER
+
+    shape = TEMPLATE_REGEX.sub(replace_match, case)
+    return shape, tuple(days), tuple(times)
+
+
+def synthesize_from_template(template: tuple, days: tuple, times: tuple) -> str:
+    """
+    Synthesizes a formatted hour entry for a new instance of a template shape by substituting its days and times into a known answer.
+
+    Args:
+        - `template` (tuple): The days, times and formatted answer of a validated instance of the template shape.
+        - `days` (tuple): The days found in the new instance (see `extract_template`).
+        - `times` (tuple): The times found in the new instance (see `extract_template`).
+
+    Preconditions:
+        - The `template` and the new instance must share the same template shape.
+
+    Returns:
+        - str: The synthesized formatted hour entry, or None if the known answer cannot be safely substituted.
+            The answer is only substituted when every day and time of the known instance appears verbatim in its answer, and every day and time field of the answer comes from the known instance.
+            This rejects answers that were derived from the values (ex. "Monday-Wednesday" expanding into three entries).
+
+    Raises:
+        - None
+
+    Example:
+        >>> template = (("Tuesday",), ("9:00", "11:00"), "Tuesday,9:00,11:00,,,,,,,,Weekly,,,")
+        >>> synthesize_from_template(template, ("Thursday",), ("13:00", "15:00"))
+        'Thursday,13:00,15:00,,,,,,,,Weekly,,,'
+    """
+    template_days, template_times, answer = template
+    if len(set(template_days)) != len(template_days) or len(set(template_times)) != len(template_times):
+        return None
+    day_mapping = dict(zip(template_days, days))
+    time_mapping = dict(zip(template_times, times))
+
+    entries = [entry.split(",") for entry in answer.split(";")]
+    if any(len(entry) < 3 for entry in entries):
+        return None
+    used_days = {entry[0] for entry in entries if entry[0] != ""}
+    used_times = {value for entry in entries for value in entry[1:3] if value != ""}
+    if used_days != set(template_days) or used_times != set(template_times):
+        return None
+
+    for entry in entries:
+        entry[0] = day_mapping.get(entry[0], entry[0])
+        entry[1] = time_mapping.get(entry[1], entry[1])
+        entry[2] = time_mapping.get(entry[2], entry[2])
+    return ";".join(",".join(entry) for entry in entries)
+
+
+def find_failed_tests(case: str, formatted_case: str, tests: list = None) -> list:
+    """
+    Runs every validation test against a single hour entry and returns the names of the tests that failed.
+
+    Args:
+        - `case` (str): The original, unformatted hour entry.
+        - `formatted_case` (str): The formatted hour entry to validate.
+        - `tests` (list): [OPTIONAL] The tests to run. Defaults to `VALIDATION_TESTS`.
+
+    Preconditions:
+        - None
+
+    Returns:
+        - list: The names of the failing validation tests. An empty list indicates a valid entry.
+
+    Raises:
+        - None
+
+    Example:
+        >>> find_failed_tests("Every Monday, from 3pm-5pm", "Monday,15:00,17:00,,,,,,,,Weekly,,,")
+        []
+        >>> find_failed_tests("Every Monday, from 3pm-5pm", "Monday,17:00,15:00,,,,,,,,Weekly,,,")
+        ['test_close_hour_greater_than_open_hour']
+        >>> find_failed_tests("nan", "", INPUT_VALIDATION_TESTS)
+        ['test_valid_case_not_empty', 'test_valid_case_contains_hours']
+    """
+    if tests is None:
+        return find_failed_rules(case, formatted_case)
+    return [test.__name__ for test in tests if not test({0: case}, {0: formatted_case}, {0: True})[0]]
+
+
+def apply_validation_rule(rule: str, id_hours_dict: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
+    """
+    Applies a single rule of the shared validation core (`hoursValidation.py`) to the cleaned hours of each program.
+
+    Args:
+        - `rule` (str): The name of the rule to apply, one of `hoursValidation.RULE_NAMES`.
+        - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
+        - `cleaned_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the cleaned/formatted hour values as values.
+        - `is_valid_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and Boolean values indicating whether the hour value is valid.
+
+    Preconditions:
+        - `cleaned_hours_dict` should be a dictionary with the `Program External IDs` as keys and cleaned/formatted hour values as values.
+        - `is_valid_hours_dict` should be a dictionary with the `Program External IDs` as keys and Boolean values indicating whether the hour value is valid.
+
+    Returns:
+        - dict: An updated `is_valid_dict` with the result of the rule for each program.
+
+    Raises:
+        - None
+
+    Example:
+        >>> apply_validation_rule("test_valid_hour_types", {}, {"ID1": "Monday,15:00,17:00,,,,,,,,Weekly,,,", "ID2": "Monday,15:00,17:00,,,,,,,,Daily,,,"}, {"ID1": True, "ID2": True})
+        {'ID1': True, 'ID2': False}
+    """
+    for key, value in cleaned_hours_dict.items():
+        is_valid_dict[key] = is_valid_dict[key] and not find_failed_rules(id_hours_dict.get(key, ""), value, rule_names=[rule])
+
+    return is_valid_dict
+
+
+def call_oai_for_segments(segments: list, executor: ThreadPoolExecutor = None) -> list:
+    """
+    Calls the `Vivery Clean Hours Training Model` for each segment, post-processing each response.
+
+    Args:
+        - `segments` (list): The preprocessed hour segments to format.
+        - `executor` (ThreadPoolExecutor): [OPTIONAL] A thread pool used to make the calls concurrently. Defaults to calling the model one segment at a time.
+
+    Preconditions:
+        - All `call_oai` preconditions must be satisfied.
+
+    Returns:
+        - list: The formatted hour entries, in the same order as `segments`.
+
+    Raises:
+        - None
+
+    Example:
+        >>> with ThreadPoolExecutor(max_workers=8) as executor:
+        ...     call_oai_for_segments(["Every Monday, from 3pm-5pm", "Tuesday 9am-11am"], executor)
+        ['Monday,15:00,17:00,,,,,,,,Weekly,,,', 'Tuesday,9:00,11:00,,,,,,,,Weekly,,,']
+    """
+    call = lambda segment: postprocess_string(call_oai(segment))
+    return list(executor.map(call, segments) if executor else map(call, segments))
+
+
+def resolve_segments(segments: set, templates: dict, report: dict, cache: dict = None, executor: ThreadPoolExecutor = None) -> dict:
+    """
+    Formats a set of unique, preprocessed hour segments, only calling the `Vivery Clean Hours Training Model` for template shapes that have not been seen before.
+
+    Args:
+        - `segments` (set): The unique, preprocessed hour segments to format.
+        - `templates` (dict): A dictionary containing template shapes as keys and validated `(days, times, answer)` tuples as values. Updated in place with newly learned shapes.
+        - `report` (dict): The run report, updated in place with the `OAI Calls`, `Template Reuses` and `Cache Hits` counts.
+        - `cache` (dict): [OPTIONAL] A dictionary containing previously formatted segments as keys and their formatted hour entries as values. Updated in place. Defaults to a new dictionary.
+        - `executor` (ThreadPoolExecutor): [OPTIONAL] A thread pool used to make the model calls concurrently.
+
+    Preconditions:
+        - All `call_oai` preconditions must be satisfied.
+
+    Returns:
+        - dict: A dictionary containing each segment as keys and its formatted hour entry as values.
+
+    Raises:
+        - None
+
+    Example:
+        >>> report = {}
+        >>> resolve_segments({"Tuesday 9am-11am", "Thursday 1pm-3pm"}, {}, report)
+        {
+            "Tuesday 9am-11am": "Tuesday,9:00,11:00,,,,,,,,Weekly,,,",
+            "Thursday 1pm-3pm": "Thursday,13:00,15:00,,,,,,,,Weekly,,,"
+        }
+        >>> print(report)
+        {'OAI Calls': 1, 'Template Reuses': 1, 'Cache Hits': 0}
+    """
+    report.setdefault("OAI Calls", 0)
+    report.setdefault("Template Reuses", 0)
+    report.setdefault("Cache Hits", 0)
+    cache = {} if cache is None else cache
+    shapes = {}
+    for segment in sorted(segments):
+        if segment in cache:
+            report["Cache Hits"] += 1
+            continue
+        shape, days, times = extract_template(segment)
+        shapes.setdefault(shape, []).append((segment, days, times))
+
+    # Call the model once per unseen shape, learning the shape when its answer passes every test
+    exemplars = [(shape, instances[0]) for shape, instances in shapes.items() if shape not in templates]
+    for (shape, (segment, days, times)), response in zip(exemplars, call_oai_for_segments([instance[0] for _, instance in exemplars], executor)):
+        cache[segment] = response
+        report["OAI Calls"] += 1
+        template = (days, times, response)
+        if not find_failed_tests(segment, response) and synthesize_from_template(template, days, times) == response:
+            templates[shape] = template
+
+    # Substitute into the learned shapes, re-checking each synthesized answer before trusting it
+    unresolved_segments = []
+    for shape, instances in shapes.items():
+        for segment, days, times in instances:
+            if segment in cache:
+                continue
+            response = synthesize_from_template(templates[shape], days, times) if shape in templates else None
+            if response is not None and not find_failed_tests(segment, response):
+                cache[segment] = response
+                report["Template Reuses"] += 1
+            else:
+                unresolved_segments.append(segment)
+    for segment, response in zip(unresolved_segments, call_oai_for_segments(unresolved_segments, executor)):
+        cache[segment] = response
+        report["OAI Calls"] += 1
+
+    return {segment: cache[segment] for segment in segments}
+
+
+def reject_invalid_inputs(id_hours_dict: dict, is_valid_hours_dict: dict, report: dict) -> dict:
+    """
+    Runs the input tests against the original, unformatted hours before any model calls are made. Rejected hours are flagged as invalid, skipping the model entirely and passing through for manual review.
+
+    Args:
+        - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
+        - `is_valid_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and Boolean values indicating whether the hour value is valid. Updated in place.
+        - `report` (dict): The run report, updated in place with the number of rejected hours for each input test.
+
+    Preconditions:
+        - `id_hours_dict` and `is_valid_hours_dict` should share the same `Program External IDs` as keys.
+
+    Returns:
+        - dict: A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values, for the hours that passed every input test.
+
+    Raises:
+        - None
+
+    Example:
+        >>> id_hours = {
+        ...     "ID1": "Every Monday, from 3pm-5pm",
+        ...     "ID2": "nan"
+        ... }
+        >>> is_valid = {"ID1": True, "ID2": True}
+        >>> report = {}
+        >>> reject_invalid_inputs(id_hours, is_valid, report)
+        {'ID1': 'Every Monday, from 3pm-5pm'}
+        >>> print(is_valid, report)
+        {'ID1': True, 'ID2': False} {'Rejected Inputs (test_valid_case_not_empty)': 1, ...}
+    """
+    for test in INPUT_VALIDATION_TESTS:
+        remaining_id_hours_dict = {key: value for key, value in id_hours_dict.items() if is_valid_hours_dict[key]}
+        test_results = test(remaining_id_hours_dict, {}, {key: True for key in remaining_id_hours_dict})
+        report["Rejected Inputs (" + test.__name__ + ")"] = list(test_results.values()).count(False)
+        for key, is_valid in test_results.items():
+            is_valid_hours_dict[key] = is_valid
+
+    return {key: value for key, value in id_hours_dict.items() if is_valid_hours_dict[key]}
+
+
+def print_run_report(report: dict) -> None:
+    """
+    Prints each count within the run report to the terminal.
+
+    Args:
+        - `report` (dict): A dictionary containing the report labels as keys and their counts as values.
+
+    Preconditions:
+        - None
+
+    Returns:
+        - None
+
+    Raises:
+        - None
+
+    Example:
+        >>> print_run_report({"OAI Calls": 12, "Template Reuses": 30})
+        \tOAI Calls: 12
+        \tTemplate Reuses: 30
+    """
+    for key, value in report.items():
+        print("\t" + key + ": " + str(value))
+
+
+def format_hours_iteratively(id_hours_dict: dict, templates: dict = None, report: dict = None, cache: dict = None, executor: ThreadPoolExecutor = None) -> dict:
     """
     Creates a dictionary of `Program External IDs` and their formatted-hour counterparts. 
+    Identical segments are only formatted once, and segments sharing a template shape with a validated answer are formatted by substitution (see `resolve_segments`).
 
     Args:
         - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
+        - `templates` (dict): [OPTIONAL] The learned template shapes, shared between calls to reuse answers across files. Defaults to a new dictionary.
+        - `report` (dict): [OPTIONAL] The run report, updated in place with the model usage counts. Defaults to a new dictionary.
+        - `cache` (dict): [OPTIONAL] The previously formatted segments, shared between calls to deduplicate segments across files. Defaults to a new dictionary.
+        - `executor` (ThreadPoolExecutor): [OPTIONAL] A thread pool used to make the model calls concurrently. Defaults to calling the model one segment at a time.
 
     Preconditions:
         - The `id_hours_dict` should be a dictionary with `Program External IDs` as keys and string representations of unformatted hours as values.
@@ -202,17 +573,134 @@ def format_hours_iteratively(id_hours_dict: dict) -> dict:
         }
     """
     cleaned_hours_dict = {}
+    templates = {} if templates is None else templates
+    report = {} if report is None else report
 
-    for key, value in id_hours_dict.items():
-        value = value.replace("/", ", ")
-        split_value = value.split(";")
-        response = map(lambda x: postprocess_string(call_oai(preprocess_string(x))), split_value)
-        new_value = ";".join(response)
-        cleaned_hours_dict[key] = new_value
+    split_hours_dict = {key: [preprocess_string(x) for x in value.replace("/", ", ").split(";")] for key, value in id_hours_dict.items()}
+    responses = resolve_segments({segment for segments in split_hours_dict.values() for segment in segments}, templates, report, cache, executor)
+
+    for key, segments in split_hours_dict.items():
+        cleaned_hours_dict[key] = ";".join(responses[segment] for segment in segments)
     
     return cleaned_hours_dict
 
 
+def clean_hours_stream(records: iter, workers: int = 8, max_in_flight: int = None, templates: dict = None, cache: dict = None) -> iter:
+    """
+    Cleans a stream of program hours in-process, yielding each program's result as soon as it completes. 
+    This is the importable equivalent of running the script on a Bulk Upload File, without reading or writing any files.
+
+    Args:
+        - `records` (iter): An iterable of `(Program External ID, uncleaned hours)` tuples. Consumed lazily, with the results completed so far yielded after each record is read.
+        - `workers` (int): [OPTIONAL] The number of programs cleaned concurrently. Defaults to 8.
+        - `max_in_flight` (int): [OPTIONAL] The maximum number of records read from `records` but not yet yielded, bounding memory use. Defaults to `workers * 4`.
+        - `templates` (dict): [OPTIONAL] The learned template shapes, shared with other runs to reuse answers. Defaults to a new dictionary.
+        - `cache` (dict): [OPTIONAL] The previously formatted segments, shared with other runs to deduplicate segments. Defaults to a new dictionary.
+
+    Preconditions:
+        - All `call_oai` preconditions must be satisfied.
+
+    Returns:
+        - iter: A generator of `(Program External ID, formatted hours, is valid, failed tests)` tuples, in order of completion.
+            As in the Bulk Upload File, invalid hours are passed through in their original, unformatted state for manual review.
+
+    Raises:
+        - None
+
+    Example:
+        >>> from clean_hours import clean_hours_stream
+        >>> for result in clean_hours_stream([("ID1", "Every Monday, from 3pm-5pm"), ("ID2", "nan")]):
+        ...     print(result)
+        ('ID2', 'nan', False, ['test_valid_case_not_empty', 'test_valid_case_contains_hours'])
+        ('ID1', 'Monday,15:00,17:00,,,,,,,,Weekly,,,', True, [])
+    """
+    templates = {} if templates is None else templates
+    cache = {} if cache is None else cache
+    max_in_flight = workers * 4 if max_in_flight is None else max_in_flight
+
+    def clean_program_hours(program_id: str, case: str) -> tuple:
+        case = str(case).strip()
+        failed_tests = find_failed_tests(case, "", INPUT_VALIDATION_TESTS)
+        if failed_tests:
+            return program_id, case, False, failed_tests
+        formatted_case = format_hours_iteratively({program_id: case}, templates, {}, cache)[program_id]
+        failed_tests = find_failed_tests(case, formatted_case)
+        return program_id, case if failed_tests else formatted_case, not failed_tests, failed_tests
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for program_id, case in records:
+            in_flight.add(executor.submit(clean_program_hours, program_id, case))
+            # Yield the programs already cleaned before reading the next record, blocking only once `max_in_flight` records are buffered
+            done, in_flight = wait(in_flight, timeout=None if len(in_flight) >= max_in_flight else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        for future in as_completed(in_flight):
+            yield future.result()
+
+
+def expand_bulk_upload_files(paths: list) -> list:
+    """
+    Expands a list of Bulk Upload File paths, directories and glob patterns into the list of Bulk Upload Files to clean.
+
+    Args:
+        - `paths` (list): The file paths, directories and glob patterns passed to the script.
+
+    Preconditions:
+        - None
+
+    Returns:
+        - list: The paths of every matched CSV file, in the order given, without duplicates or previously cleaned (`_HOURS_CLEANED`) files.
+
+    Raises:
+        - None
+
+    Example:
+        >>> expand_bulk_upload_files(["uploads", "network_1.csv"])
+        ['uploads/network_2.csv', 'uploads/network_3.csv', 'network_1.csv']
+    """
+    files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "*.csv")))
+        else:
+            matches = sorted(glob.glob(path)) or [path]
+        for match in matches:
+            if match not in files and not match.endswith("_HOURS_CLEANED.csv"):
+                files.append(match)
+
+    return files
+
+
+def find_duplicate_basenames(files: list) -> dict:
+    """
+    Finds the Bulk Upload Files that share a file name, since each file is moved to, and its output written to, `csvs/` by its file name.
+
+    Args:
+        - `files` (list): The paths of the Bulk Upload Files to clean.
+
+    Preconditions:
+        - None
+
+    Returns:
+        - dict: The shared file names as keys, and the paths sharing each one as values. Empty when every file name is unique.
+
+    Raises:
+        - None
+
+    Example:
+        >>> find_duplicate_basenames(["a/upload.csv", "b/upload.csv", "network_1.csv"])
+        {'upload.csv': ['a/upload.csv', 'b/upload.csv']}
+    """
+    paths_by_basename = {}
+
+    for file in files:
+        paths_by_basename.setdefault(os.path.basename(file), []).append(file)
+
+    return {basename: paths for basename, paths in paths_by_basename.items() if len(paths) > 1}
+
+
 def filter_invalid_values(id_hours_dict: dict, cleaned_hours_dict: dict, is_valid_hours_dict: dict) -> dict:
     """
     Removes cleaned hour entries that failed one or more tests during the testing phase. This process flags them for human review, returning the hours to their original, unformatted state.
@@ -375,20 +863,7 @@ def test_valid_day_of_week(_: any, cleaned_hours_dict: dict, is_valid_dict: dict
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                is_valid = value[0] in DAYS_OF_WEEK or (value[0] == "" and value[10] == "Call for Information") and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_valid_day_of_week", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_valid_entry_format(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -429,14 +904,7 @@ def test_valid_entry_format(_: dict, cleaned_hours_dict: dict, is_valid_dict: di
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        count_semicolons = value.count(";")
-        count_commas = value.count(",")
-        is_valid = 13 + count_semicolons * 13 == count_commas
-        is_valid = (count_semicolons < 1 and count_commas == 13) or (count_semicolons >= 1 and count_commas > 13) and is_valid
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_valid_entry_format", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_valid_open_closed_hours(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -477,27 +945,8 @@ def test_valid_open_closed_hours(_: dict, cleaned_hours_dict: dict, is_valid_dic
             "ID3": False
         }
     """
-    time_regex = re.compile("^([01]?[0-9]|2[0-3]):[0-5][0-9]$")
-
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
+    return apply_validation_rule("test_valid_open_closed_hours", _, cleaned_hours_dict, is_valid_dict)
 
-        for value in list_of_entries:
-            value = value.split(",")
-            if value[10] == "Call for Information":
-                continue
-            try:
-                is_open_hour_valid = re.search(time_regex, value[1])
-                is_closed_hour_valid = re.search(time_regex, value[2])
-                is_valid = (is_open_hour_valid != None or value[1] == "") and (is_closed_hour_valid != None or value[2] == "") and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-    
-    return is_valid_dict
-            
 
 def test_close_hour_greater_than_open_hour(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
     """
@@ -537,22 +986,7 @@ def test_close_hour_greater_than_open_hour(_: dict, cleaned_hours_dict: dict, is
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                is_valid = datetime.strptime(value[2], "%H:%M") > datetime.strptime(value[1], "%H:%M") and is_valid
-            except ValueError:
-                is_valid = value[10] == "Call for Information" and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_close_hour_greater_than_open_hour", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_day_of_month_formatting(id_hours_dict: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -598,22 +1032,7 @@ def test_day_of_month_formatting(id_hours_dict: dict, cleaned_hours_dict: dict,
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                if value[10] == "Day of Month":
-                    is_valid = value[9].isdigit() and value[8] == "" and is_valid
-                    is_valid = (any(day_of_month_value.lower() in id_hours_dict[key].lower() for day_of_month_value in INT_TO_DAY_OF_MONTH[value[9]]) or value[9] == "") and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_day_of_month_formatting", id_hours_dict, cleaned_hours_dict, is_valid_dict)
 
 
 def test_week_of_month_formatting(id_hours_dict: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -659,22 +1078,7 @@ def test_week_of_month_formatting(id_hours_dict: dict, cleaned_hours_dict: dict,
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                if value[10] == "Week of Month":
-                    is_valid = value[8].isdigit() and value[9] == "" and is_valid
-                    is_valid = (any(day_of_week_value.lower() in id_hours_dict[key].lower() for day_of_week_value in INT_TO_DAY_OF_MONTH[value[8]]) or value[8] == "") and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_week_of_month_formatting", id_hours_dict, cleaned_hours_dict, is_valid_dict)
 
 
 def test_weekly_formatting(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -715,41 +1119,13 @@ def test_weekly_formatting(_: dict, cleaned_hours_dict: dict, is_valid_dict: dic
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                if value[10] == "Weekly" or value[10] == "Every Other Week":
-                    is_valid = value[8] == "" and value[9] == "" and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_weekly_formatting", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_call_for_information_formatting(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
     """
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                if value[10] == "Call for Information":
-                    is_valid = len("".join(value[0:7])) == 0 and len("".join(value[8:10])) == 0 and len("".join(value[11:])) == 0 and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_call_for_information_formatting", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_all_null_values_empty_string(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -790,20 +1166,7 @@ def test_all_null_values_empty_string(_: dict, cleaned_hours_dict: dict, is_vali
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                is_valid = value[3] == "" and value[4] == "" and value[5] == "" and value[6] == "" and value[11] == "" and value[12] == "" and value[13] == "" and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_all_null_values_empty_string", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_valid_hour_types(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict) -> dict:
@@ -844,25 +1207,13 @@ def test_valid_hour_types(_: dict, cleaned_hours_dict: dict, is_valid_dict: dict
             "ID3": False
         }
     """
-    for key, value in cleaned_hours_dict.items():
-        is_valid = True
-        list_of_entries = value.split(";")
-
-        for value in list_of_entries:
-            value = value.split(",")
-            try:
-                is_valid = value[10] in HOUR_TYPES and is_valid
-            except:
-                is_valid = False
-
-        is_valid_dict[key] = is_valid_dict[key] and is_valid
-
-    return is_valid_dict
+    return apply_validation_rule("test_valid_hour_types", _, cleaned_hours_dict, is_valid_dict)
 
 
 def test_valid_case_length(id_hours_dict: dict, _: dict, is_valid_dict: dict) -> dict:
     """
-    Test if the length of the case in 'id_hours_dict' is less than 100 characters for each key.
+    Test if each `;` separated segment of the case in 'id_hours_dict' is shorter than `hoursValidation.MAX_SEGMENT_LENGTH` characters for each key.
+    Schedules of many days are long, but each of their segments is short, so only run-on segments are rejected.
 
     Args:
         - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
@@ -881,8 +1232,8 @@ def test_valid_case_length(id_hours_dict: dict, _: dict, is_valid_dict: dict) ->
 
     Example:
         >>> id_hours_dict = {
-        ...     "ID1": "Monday-Friday 3-5pm",
-        ...     "ID2": "This is a very long case that exceeds 100 characters",
+        ...     "ID1": "Monday 9am-5pm; Tuesday 9am-5pm; Wednesday 9am-5pm; Thursday 9am-5pm; Friday 9am-5pm; Saturday 10am-2pm",
+        ...     "ID2": "Open most weekdays in the morning unless a volunteer is unavailable, in which case please call ahead first",
         ...     "ID3": "Thursday 11am-2pm every other week"
         ... }
         >>> is_valid_dict = {
@@ -899,13 +1250,13 @@ def test_valid_case_length(id_hours_dict: dict, _: dict, is_valid_dict: dict) ->
         }
     """
     for key, value in id_hours_dict.items():
-        is_valid_dict[key] = len(value) < 100 and is_valid_dict[key]
+        is_valid_dict[key] = is_input_segment_length_valid(value) and is_valid_dict[key]
     return is_valid_dict
 
 
 def test_valid_case_characters(id_hours_dict: dict, _: dict, is_valid_dict: dict) -> dict:
     """
-    Test if case descriptions in 'id_hours_dict' contain any invalid characters.
+    Test if case descriptions in 'id_hours_dict' contain any of the `hoursValidation.INVALID_CHARACTERS`, which do not occur in written hours.
 
     Args:
         - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
@@ -917,16 +1268,15 @@ def test_valid_case_characters(id_hours_dict: dict, _: dict, is_valid_dict: dict
         - `is_valid_dict` should be a dictionary indicating the initial validity state for each case.
 
     Returns:
-        dict: An updated dictionary ('is_valid_dict') with the validity of each case based on the length criterion.
+        dict: An updated dictionary ('is_valid_dict') with the validity of each case based on the invalid characters criterion.
 
     Raises:
         None
 
     Example:
-        >>> INVALID_CHARACTERS = "/"
         >>> id_hours_dict = {
         ...     "ID1": "Monday-Friday 3-5pm",
-        ...     "ID2": "Tuesday/Thursday 6-9pm",
+        ...     "ID2": "<b>Tuesday</b> 6-9pm",
         ...     "ID3": "Thursday 11am-2pm every other week"
         ... }
         >>> is_valid_dict = {
@@ -934,7 +1284,7 @@ def test_valid_case_characters(id_hours_dict: dict, _: dict, is_valid_dict: dict
         ...     "ID2": True,
         ...     "ID3": False
         ... }
-        >>> result = test_valid_case_length(id_hours_dict, {}, is_valid_dict)
+        >>> result = test_valid_case_characters(id_hours_dict, {}, is_valid_dict)
         >>> print(result)
         {
             "ID1": True,
@@ -943,67 +1293,198 @@ def test_valid_case_characters(id_hours_dict: dict, _: dict, is_valid_dict: dict
         }
     """
     for key, value in id_hours_dict.items():
-        is_valid = True
-        for character in INVALID_CHARACTERS:
-            is_valid = character not in value and is_valid
-        is_valid_dict[key] = is_valid and is_valid_dict[key]
+        is_valid_dict[key] = is_input_characters_valid(value) and is_valid_dict[key]
     return is_valid_dict
 
 
+def test_valid_case_not_empty(id_hours_dict: dict, _: dict, is_valid_dict: dict) -> dict:
+    """
+    Test if case descriptions in 'id_hours_dict' are not empty, including the "nan" strings produced from empty cells in the Bulk Upload File.
+
+    Args:
+        - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
+        - `_` (dict): [UNUSED] A dictionary containing the `Program External IDs` as keys and the cleaned/formatted hour values as values.
+        - `is_valid_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and Boolean values indicating whether the hour value is valid.
+
+    Preconditions:
+        - `id_hours_dict` should be a dictionary with program IDs as keys and case descriptions as values.
+        - `is_valid_dict` should be a dictionary indicating the initial validity state for each case.
+
+    Returns:
+        dict: An updated dictionary ('is_valid_dict') with the validity of each case based on the empty value criterion.
+
+    Raises:
+        None
+
+    Example:
+        >>> id_hours_dict = {
+        ...     "ID1": "Monday-Friday 3-5pm",
+        ...     "ID2": "nan",
+        ...     "ID3": ""
+        ... }
+        >>> is_valid_dict = {
+        ...     "ID1": True,
+        ...     "ID2": True,
+        ...     "ID3": True
+        ... }
+        >>> result = test_valid_case_not_empty(id_hours_dict, {}, is_valid_dict)
+        >>> print(result)
+        {
+            "ID1": True,
+            "ID2": False,
+            "ID3": False
+        }
+    """
+    for key, value in id_hours_dict.items():
+        is_valid_dict[key] = is_input_not_empty(value) and is_valid_dict[key]
+    return is_valid_dict
+
+
+def test_valid_case_contains_hours(id_hours_dict: dict, _: dict, is_valid_dict: dict) -> dict:
+    """
+    Test if case descriptions in 'id_hours_dict' contain any hours content (a digit, a day of the week, or an hours keyword such as "daily" or "call").
+
+    Args:
+        - `id_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and the original unformatted hour values as values.
+        - `_` (dict): [UNUSED] A dictionary containing the `Program External IDs` as keys and the cleaned/formatted hour values as values.
+        - `is_valid_hours_dict` (dict): A dictionary containing the `Program External IDs` as keys and Boolean values indicating whether the hour value is valid.
+
+    Preconditions:
+        - `id_hours_dict` should be a dictionary with program IDs as keys and case descriptions as values.
+        - `is_valid_dict` should be a dictionary indicating the initial validity state for each case.
+
+    Returns:
+        dict: An updated dictionary ('is_valid_dict') with the validity of each case based on the hours content criterion.
+
+    Raises:
+        None
+
+    Example:
+        >>> id_hours_dict = {
+        ...     "ID1": "Monday-Friday 3-5pm",
+        ...     "ID2": "See website",
+        ...     "ID3": "Call for information"
+        ... }
+        >>> is_valid_dict = {
+        ...     "ID1": True,
+        ...     "ID2": True,
+        ...     "ID3": True
+        ... }
+        >>> result = test_valid_case_contains_hours(id_hours_dict, {}, is_valid_dict)
+        >>> print(result)
+        {
+            "ID1": True,
+            "ID2": False,
+            "ID3": True
+        }
+    """
+    for key, value in id_hours_dict.items():
+        is_valid_dict[key] = is_input_hours_content(value) and is_valid_dict[key]
+    return is_valid_dict
+
+
+
+
+# Input tests run against every unformatted hour entry before it is sent to the model, in order
+INPUT_VALIDATION_TESTS = [
+    test_valid_case_not_empty,
+    test_valid_case_length,
+    test_valid_case_characters,
+    test_valid_case_contains_hours,
+]
+
+# Validation tests run against every formatted hour entry, in order
+VALIDATION_TESTS = [
+    test_day_of_month_formatting,
+    test_week_of_month_formatting,
+    test_weekly_formatting,
+    test_valid_hour_types,
+    test_valid_day_of_week,
+    test_valid_open_closed_hours,
+    test_close_hour_greater_than_open_hour,
+    test_all_null_values_empty_string,
+    test_valid_entry_format,
+    test_call_for_information_formatting,
+]
+
+
 
 
 # MAIN
 if __name__ == "__main__":
     # Define console parser
-    parser = argparse.ArgumentParser(description="Clean a bulk upload files hours")
+    parser = argparse.ArgumentParser(description="Clean the hours of one or more bulk upload files")
     # Add file argument
-    parser.add_argument("file", action="store", help="A bulk upload file")
+    parser.add_argument("files", action="store", nargs="+", help="One or more bulk upload files, directories or glob patterns")
+    # Add workers argument
+    parser.add_argument("--workers", action="store", type=int, default=8, help="The number of concurrent OAI calls shared by all files")
     # Console arguments
     args = parser.parse_args()
+    # Print the model responses logged while cleaning
+    LOGGER.addHandler(logging.StreamHandler(sys.stdout))
+    LOGGER.setLevel(logging.INFO)
+
+    # Reject Bulk Upload Files sharing a file name, before any file is moved, as they would overwrite each other within `csvs/`
+    files = expand_bulk_upload_files(args.files)
+    duplicate_basenames = find_duplicate_basenames(files)
+    if duplicate_basenames:
+        parser.error("Bulk Upload Files must have unique file names: " + "; ".join(", ".join(paths) for paths in duplicate_basenames.values()))
 
-    # Create DataFrame
-    df = pd.read_csv(args.file)
-    # Move CSV
+    # Create CSVs Directory
     if not os.path.isdir('csvs'):
         os.mkdir('csvs')
-    shutil.move(args.file, "csvs/" + args.file.replace("csvs/", ""))
-    # Create id_hours Dictionary
-    id_hours_dict = create_id_hours_dict(df)
-    # Create is_valid_hours Dictionary
-    is_valid_hours_dict = {key: True for key, _ in id_hours_dict.items()}
+    dfs = {}
+    id_hours_dicts = {}
+    is_valid_hours_dicts = {}
+    report = {}
+
+    for file in files:
+        # Create DataFrame
+        dfs[file] = pd.read_csv(file)
+        # Move CSV
+        shutil.move(file, "csvs/" + os.path.basename(file))
+        # Create id_hours Dictionary
+        id_hours_dicts[file] = create_id_hours_dict(dfs[file])
+        # Create is_valid_hours Dictionary
+        is_valid_hours_dicts[file] = {key: True for key, _ in id_hours_dicts[file].items()}
+
+    # Reject Hours that cannot be cleaned before calling OAI, keyed by file to deduplicate hours across every file
+    print("Testing uncleaned hours...")
+    id_hours_dict = {(file, key): value for file, file_id_hours_dict in id_hours_dicts.items() for key, value in file_id_hours_dict.items()}
+    is_valid_hours_dict = {(file, key): value for file, file_is_valid_hours_dict in is_valid_hours_dicts.items() for key, value in file_is_valid_hours_dict.items()}
+    accepted_id_hours_dict = reject_invalid_inputs(id_hours_dict, is_valid_hours_dict, report)
 
     # Parse Hours through OAI
     print("Calling OpenAI Fine-Tuned Model...")
-    cleaned_hours_dict = format_hours_iteratively(id_hours_dict)
-
-    # Test OAI Hours 
-    print("\nTesting OpenAI Fine-Tuned Model responses...")
-    validation_tests = [
-        test_day_of_month_formatting,
-        test_week_of_month_formatting,
-        test_weekly_formatting,
-        test_valid_hour_types,
-        test_valid_day_of_week,
-        test_valid_open_closed_hours,
-        test_close_hour_greater_than_open_hour,
-        test_all_null_values_empty_string,
-        test_valid_entry_format,
-        test_call_for_information_formatting,
-        # test_valid_case_length,
-        # test_valid_case_characters
-    ]
-    [test(id_hours_dict, cleaned_hours_dict, is_valid_hours_dict) for test in validation_tests]
-
-    # PRINT TESTING RESULTS (CAN BE REMOVED LATER)
-    for key, value in is_valid_hours_dict.items():
-        print("\tProgram ID: " + str(key) + "\t\tResult: " + str(value))
-
-    # Check Values Still Valid
-    valid_id_hours_dict = filter_invalid_values(id_hours_dict, cleaned_hours_dict, is_valid_hours_dict)
-
-    # Convert Back to DF
-    cleaned_hours_df = convert_id_hours_dict_to_df(cleaned_hours_dict, is_valid_hours_dict, df)
-    if not os.path.isdir('csvs'):
-        os.mkdir('csvs')
-    cleaned_hours_df.to_csv("csvs/" + args.file.replace(".csv", "").replace("csvs/", "") + "_HOURS_CLEANED.csv")
-    # cleaned_hours_df.to_csv(args.file.replace(".csv", "") + "_HOURS_CLEANED.csv")
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        cleaned_hours_dict = format_hours_iteratively(accepted_id_hours_dict, report=report, executor=executor)
+    cleaned_hours_dict.update({key: value for key, value in id_hours_dict.items() if key not in cleaned_hours_dict})
+
+    for file, df in dfs.items():
+        file_id_hours_dict = id_hours_dicts[file]
+        file_cleaned_hours_dict = {key: cleaned_hours_dict[(file, key)] for key in file_id_hours_dict}
+        file_is_valid_hours_dict = {key: is_valid_hours_dict[(file, key)] for key in file_id_hours_dict}
+
+        # Test OAI Hours, skipping the rejected hours that were never sent to OAI
+        print("\nTesting OpenAI Fine-Tuned Model responses for " + file + "...")
+        accepted_cleaned_hours_dict = {key: value for key, value in file_cleaned_hours_dict.items() if file_is_valid_hours_dict[key]}
+        for key, value in accepted_cleaned_hours_dict.items():
+            file_is_valid_hours_dict[key] = file_is_valid_hours_dict[key] and not find_failed_rules(file_id_hours_dict[key], value, early_exit=True)
+
+        # PRINT TESTING RESULTS (CAN BE REMOVED LATER)
+        for key, value in file_is_valid_hours_dict.items():
+            print("\tProgram ID: " + str(key) + "\t\tResult: " + str(value))
+        report["Valid Hours"] = report.get("Valid Hours", 0) + list(file_is_valid_hours_dict.values()).count(True)
+        report["Invalid Hours"] = report.get("Invalid Hours", 0) + list(file_is_valid_hours_dict.values()).count(False)
+
+        # Check Values Still Valid
+        valid_id_hours_dict = filter_invalid_values(file_id_hours_dict, file_cleaned_hours_dict, file_is_valid_hours_dict)
+
+        # Convert Back to DF
+        cleaned_hours_df = convert_id_hours_dict_to_df(file_cleaned_hours_dict, file_is_valid_hours_dict, df)
+        cleaned_hours_df.to_csv("csvs/" + os.path.basename(file).replace(".csv", "") + "_HOURS_CLEANED.csv")
+
+    # Print Run Report
+    report["Files Cleaned"] = len(dfs)
+    print("\nRun Report:")
+    print_run_report(report)
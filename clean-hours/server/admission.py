@@ -0,0 +1,268 @@
+"""
+This module contains the admission control and circuit breaker placed in front of the normalizeHours server's upstream calls.
+
+The admission controller runs the segments sent upstream on a bounded number of worker threads, its slots, behind a bounded waiting queue.
+The segments of a request are admitted together before any of them is queued, so a request arriving while the queue is full fails fast
+with an `AdmissionRejected` error, instead of piling up behind a throttled upstream. Segments waiting for a slot for too long fail the same way.
+Each client's segments wait in their own queue, and a freed slot goes to the waiting client with the fewest segments in flight, giving each client a fair share.
+
+The circuit breaker opens after a burst of upstream failures, failing calls fast with a `CircuitOpen` error.
+Once open for long enough, a single probe call is let through, closing the circuit if it succeeds and reopening it if it fails.
+"""
+
+
+# PACKAGE IMPORTS
+import collections
+import itertools
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+
+
+
+# ERRORS
+class UpstreamUnavailable(Exception):
+    """
+    Raised when an upstream call is refused without being attempted. `retry_after` is the suggested wait in seconds.
+    """
+    status = 503
+
+    def __init__(
+        self,
+        message: str,
+        retry_after: float,
+    ) -> None:
+        """
+        """
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionRejected(UpstreamUnavailable):
+    """
+    Raised when the admission queue is saturated.
+    """
+    status = 429
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """
+    Raised when the circuit breaker is open.
+    """
+    status = 503
+
+
+
+
+# ADMISSION CONTROL
+class AdmissionController:
+    """
+    Runs upstream work on `max_concurrent` worker threads, behind a bounded, timed waiting queue shared fairly between clients.
+    A request's calls are admitted or rejected together when they are submitted, before any of them waits for a slot.
+    When a worker frees up, it runs the oldest call of the waiting client with the fewest calls running, so one busy client cannot starve the others.
+    """
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        queue_timeout: float,
+        retry_after: float,
+    ) -> None:
+        """
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.queues_by_client = {}
+        self.in_flight = 0
+        self.in_flight_by_client = {}
+        self.tickets = itertools.count()
+        self.rejected = 0
+        self.pid = None
+
+    @property
+    def waiting(
+        self,
+    ) -> int:
+        """
+        """
+        return sum(len(queue) for queue in self.queues_by_client.values())
+
+    def submit_all(
+        self,
+        calls: list,
+        client: str = "",
+    ) -> list:
+        """
+        Queues a client's `(function, *args)` calls, and returns one future per call, in order.
+        Raises `AdmissionRejected` without queueing any call when `max_concurrent` calls are running and `max_queue` calls are already waiting.
+        """
+        with self.condition:
+            self.start_workers()
+            self.expire()
+            if self.in_flight + self.waiting >= self.max_concurrent + self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("Too many requests are waiting on the upstream model.", self.retry_after)
+            deadline = time.monotonic() + self.queue_timeout
+            queue = self.queues_by_client.setdefault(client, collections.deque())
+            futures = []
+            for function, *args in calls:
+                future = Future()
+                queue.append((next(self.tickets), deadline, future, function, args))
+                futures.append(future)
+            self.condition.notify_all()
+        return futures
+
+    def start_workers(
+        self,
+    ) -> None:
+        """
+        Starts the worker threads on first use, and again in a forked worker process, which does not inherit them. Must be called while holding the condition.
+        """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.queues_by_client = {}
+        self.in_flight = 0
+        self.in_flight_by_client = {}
+        for target in [self.expire_forever] + [self.work] * self.max_concurrent:
+            threading.Thread(target=target, daemon=True).start()
+
+    def work(
+        self,
+    ) -> None:
+        """
+        Runs queued calls one at a time, taking the oldest call of the waiting client with the fewest calls running.
+        """
+        while True:
+            with self.condition:
+                while not self.queues_by_client:
+                    self.condition.wait()
+                client = min(self.queues_by_client, key=lambda client: (self.in_flight_by_client.get(client, 0), self.queues_by_client[client][0][0]))
+                _, _, future, function, args = self.queues_by_client[client].popleft()
+                if not self.queues_by_client[client]:
+                    del self.queues_by_client[client]
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.in_flight += 1
+                self.in_flight_by_client[client] = self.in_flight_by_client.get(client, 0) + 1
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.in_flight -= 1
+                    self.in_flight_by_client[client] -= 1
+                    if self.in_flight_by_client[client] == 0:
+                        del self.in_flight_by_client[client]
+
+    def expire(
+        self,
+    ) -> None:
+        """
+        Drops the cancelled calls from the queue, and fails the calls queued for more than `queue_timeout` seconds. Must be called while holding the condition.
+        """
+        now = time.monotonic()
+        queues_by_client = {}
+        for client, queue in self.queues_by_client.items():
+            for ticket, deadline, future, function, args in queue:
+                if future.cancelled():
+                    continue
+                if deadline > now:
+                    queues_by_client.setdefault(client, collections.deque()).append((ticket, deadline, future, function, args))
+                elif future.set_running_or_notify_cancel():
+                    self.rejected += 1
+                    future.set_exception(AdmissionRejected("Timed out waiting on the upstream model.", self.retry_after))
+        self.queues_by_client = queues_by_client
+
+    def expire_forever(
+        self,
+    ) -> None:
+        """
+        Fails timed out calls as soon as they time out, rather than when a worker next frees up.
+        """
+        with self.condition:
+            while True:
+                self.expire()
+                self.condition.wait(min(queue[0][1] for queue in self.queues_by_client.values()) - time.monotonic() if self.queues_by_client else None)
+
+
+
+
+# CIRCUIT BREAKER
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` failures within `window_seconds`, and probes for recovery after `open_seconds`.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        window_seconds: float,
+        open_seconds: float,
+    ) -> None:
+        """
+        """
+        self.failure_threshold = failure_threshold
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = []
+        self.opened_at = 0.0
+
+    def before_call(
+        self,
+    ) -> None:
+        """
+        Raises `CircuitOpen` unless the call may proceed. Moves an open circuit to half-open once `open_seconds` have passed, letting one probe call through.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.open_seconds - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpen("The upstream model is failing, and the circuit breaker is open.", max(remaining, 1))
+
+    def record_success(
+        self,
+    ) -> None:
+        """
+        """
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = []
+
+    def record_failure(
+        self,
+    ) -> None:
+        """
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.failures = [failure for failure in self.failures if failure > now - self.window_seconds] + [now]
+            if self.state == self.HALF_OPEN or len(self.failures) >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = now
+
+    def release_probe(
+        self,
+    ) -> None:
+        """
+        Returns a half-open circuit to open when its probe call ended without an upstream result, so a later call can probe again.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() - self.open_seconds
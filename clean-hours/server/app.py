@@ -3,35 +3,177 @@ This module contains the Flask app that serves the API endpoints for the normali
 
 The app has the following routes:
 - GET /: Returns a simple message to confirm that the app is running.
-- GET /normalizeHours/<inputString>: Returns the normalized hours from the input string.
+- GET /normalizeHours/<inputString>: Returns the normalized hours from the input string, with an ETag and Cache-Control header. A matching If-None-Match returns a 304 without normalizing the input string.
+  A response decided invalid before every segment was formatted has `partial` set and empty entries for the cancelled segments, and is sent with `Cache-Control: no-store` and no ETag.
+- GET /normalizeHours/<inputString>/stream: Streams each segment's formatted entry as Server-Sent Events as soon as it completes, followed by the aggregate result.
+- POST /normalizeHours/batch: Normalizes a JSON array of input strings, streaming one NDJSON response per string as each completes. The stream is compressed with br or gzip when the client accepts it.
+- POST /validateHours: Validates a JSON array of already formatted strings and their original input strings, without calling the model.
+- GET /cache/stats: Returns the hit, miss and eviction statistics of the result cache, and the number of coalesced requests.
+- GET /metrics: Returns the operational metrics of the server in the Prometheus text format.
+- POST /jobs: Queues a bulk upload file to have its hours cleaned in the background, returning the job's ID.
+- GET /jobs/<jobId>: Returns the status and progress of a job (rows done, valid and invalid rows, and ETA).
+- GET /jobs/<jobId>/result: Downloads the `_HOURS_CLEANED.csv` file of a finished job.
+
+Jobs are persisted under `JOBS_DIRECTORY`, and jobs interrupted by a restart are resumed on startup.
+
+The result cache is loaded from `CACHE_SNAPSHOT_PATH` on startup, and snapshotted back to it on shutdown.
+The historical mappings of the warm indexes (or historical bulk upload files) listed in `CACHE_WARM_PATHS` are pinned into it on startup (see `warmCache.py`).
+
+Each request is traced when `TRACE_EXPORTER` is set (see `tracing.py`), continuing the trace of an incoming `traceparent` header.
+A request's root span ends when its response is closed, so it covers the whole of a streamed response.
+
+Each client is limited by its request and upstream token quotas (see `quotas.py`), with its remaining quota sent in `X-RateLimit-*` and `X-TokenLimit-*` headers.
 
 The app also has error handlers for the following status codes:
 - 400: Bad Request
 - 404: Not Found
+- 409: Conflict (the result of a job that has not finished is requested)
+- 429: Too Many Requests (the client's quota is used up, or the upstream admission queue is saturated, with a Retry-After header)
 - 500: Internal Server Error
+- 503: Service Unavailable (the upstream circuit breaker is open, with a Retry-After header)
+- 504: Gateway Timeout (the input string was not formatted before its deadline, with a Retry-After header)
 
-The app is run with the following command:
+The app is run with the following command during development:
 ```
 python app.py
 ```
 
+In production, the app is served by the pre-fork server in `serve.py` instead:
+```
+python serve.py
+```
+
 The app can be accessed at http://localhost:5000
 
 The app requires the following packages:
 * Flask
 * flask_cors
+* brotli (optional, for br compressed batch responses)
 """
 
 # IMPORTS
-from flask import Flask, jsonify, abort
+from flask import Flask, Response, jsonify, abort, request, send_file, g
 from flask_cors import CORS
-from normalizeHours import normalize_input_string
+import json
+import os
+import zlib
+import atexit
+import signal
+import sys
+import time
+from admission import UpstreamUnavailable
+from jobs import create_job, get_job, get_job_result_path, resume_jobs, JobNotFound
+from normalizeHours import normalize_input_string, normalize_input_strings, stream_input_string, validate_formatted_strings, response_etag, BATCH_MAX_SIZE, VALIDATE_MAX_SIZE, RESULT_CACHE, CACHE_SNAPSHOT_PATH, IN_FLIGHT_REQUESTS
+from metrics import render_metrics, REQUEST_LATENCY, REQUESTS_IN_FLIGHT
+from tracing import start_trace, current_span, bind_iterator
+from quotas import client_id, take_request, CURRENT_CLIENT
+from warmCache import warm_cache, CACHE_WARM_PATHS
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 # Create a new Flask app
 app = Flask(__name__)
 CORS(app)
 
+# Warm the result cache from the last snapshot, and pin the historical mappings of the warm index
+if CACHE_SNAPSHOT_PATH:
+    RESULT_CACHE.load(CACHE_SNAPSHOT_PATH)
+if CACHE_WARM_PATHS:
+    warm_cache(CACHE_WARM_PATHS.split(os.pathsep))
+
+# Snapshot the cache on shutdown and resume the jobs interrupted by the last shutdown, unless a pre-fork server does both in each worker
+if not os.getenv("SERVER_PREFORK"):
+    if CACHE_SNAPSHOT_PATH:
+        atexit.register(RESULT_CACHE.snapshot, CACHE_SNAPSHOT_PATH)
+    resume_jobs()
+
+# Requests to these endpoints are not charged to the client's quotas
+QUOTA_EXEMPT_ENDPOINTS = ["root", "metrics", "cache_stats"]
+
+# Normalized responses are deterministic for a given input string and model, so they can be cached by clients and proxies
+CACHE_CONTROL = f"public, max-age={int(os.getenv('CACHE_CONTROL_MAX_AGE', '86400'))}"
+
+
+# HELPERS
+def compress_stream(
+    chunks: iter,
+    encoding: str,
+) -> iter:
+    """
+    Compresses a stream of text chunks, flushing after each chunk so the client still receives each one as soon as it is sent.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            yield compressor.process(chunk.encode()) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+# REQUEST HOOKS
+@app.before_request
+def start_request_timer(
+) -> None:
+    """
+    """
+    g.start_time = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.trace_span = start_trace(f"{request.method} {route}", request.headers.get("traceparent"), method=request.method, route=route, path=request.path)
+    g.trace_span.__enter__()
+
+@app.before_request
+def charge_client_quota(
+) -> None:
+    """
+    Charges the request to the client's quota, raising a 429 if the quota is used up. CORS preflight requests are not charged.
+    """
+    g.rate_limit_headers = {}
+    if request.endpoint not in QUOTA_EXEMPT_ENDPOINTS and request.method != "OPTIONS":
+        client = client_id(request.headers, request.remote_addr)
+        g.client_token = CURRENT_CLIENT.set(client)
+        take_request(client, g.rate_limit_headers)
+
+@app.after_request
+def record_request_latency(
+    response: Response,
+) -> Response:
+    """
+    """
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_LATENCY.observe(time.perf_counter() - g.start_time, route=route, method=request.method, status=response.status_code)
+    g.trace_span.set_attribute("status", response.status_code)
+    response.headers.update(g.get("rate_limit_headers", {}))
+    if current_span().traceparent() is not None:
+        response.headers["traceparent"] = current_span().traceparent()
+    # The root span ends once the response is closed, after a streamed body has been sent, rather than when the view returns
+    response.call_on_close(g.trace_span.end)
+    g.trace_span_ends_on_close = True
+    return response
+
+@app.teardown_request
+def end_request(
+    e: Exception,
+) -> None:
+    """
+    """
+    REQUESTS_IN_FLIGHT.dec()
+    if "client_token" in g:
+        CURRENT_CLIENT.reset(g.client_token)
+    if "trace_span" in g:
+        if e is not None:
+            g.trace_span.record_exception(e)
+        g.trace_span.detach()
+        if "trace_span_ends_on_close" not in g:
+            g.trace_span.end()
+
 
 # ERROR HANDLERS
 @app.errorhandler(400)
@@ -50,6 +192,14 @@ def not_found(
     """
     return {"Error": str(e)}, 404
 
+@app.errorhandler(409)
+def conflict(
+    e: Exception,
+) -> tuple:
+    """
+    """
+    return {"Error": str(e)}, 409
+
 @app.errorhandler(500)
 def internal_server_error(
     e: Exception,
@@ -58,6 +208,14 @@ def internal_server_error(
     """
     return {"Error": str(e)}, 500
 
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(
+    e: UpstreamUnavailable,
+) -> tuple:
+    """
+    """
+    return {"Error": str(e)}, e.status, {"Retry-After": str(e.retry_after)}
+
 
 # ROUTES
 @app.route("/", methods=["GET"])
@@ -73,13 +231,115 @@ def normalize_hours(
 ) -> tuple:
     """
     """
+    etag = response_etag(inputString)
+    headers = {"ETag": f"\"{etag}\"", "Cache-Control": CACHE_CONTROL}
+    if request.if_none_match.contains_weak(etag):
+        return "", 304, headers
     try:
         response = normalize_input_string(inputString)
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         abort(400, description=str(e))
-    return jsonify(response), 200
+    if response.get("partial"):
+        headers = {"Cache-Control": "no-store"}
+    return jsonify(response), 200, headers
+
+@app.route("/normalizeHours/<inputString>/stream", methods=["GET"])
+def normalize_hours_stream(
+    inputString: str,
+) -> Response:
+    """
+    Sends a `segment` event per segment in completion order, then a `result` event with the aggregate `isValid`.
+    """
+    events = (f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in bind_iterator(stream_input_string(inputString)))
+    return Response(events, status=200, mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/normalizeHours/batch", methods=["POST"])
+def normalize_hours_batch(
+) -> Response:
+    """
+    """
+    cases = request.get_json(silent=True)
+    if not isinstance(cases, list) or not all(isinstance(case, str) for case in cases):
+        abort(400, description="Request body must be a JSON array of input strings.")
+    if len(cases) > BATCH_MAX_SIZE:
+        abort(400, description=f"Request body must contain at most {BATCH_MAX_SIZE} input strings.")
+    responses = (json.dumps(response) + "\n" for response in bind_iterator(normalize_input_strings(cases)))
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if brotli is not None else ["gzip"])
+    if encoding is None:
+        return Response(responses, status=200, mimetype="application/x-ndjson", headers={"Vary": "Accept-Encoding"})
+    return Response(compress_stream(responses, encoding), status=200, mimetype="application/x-ndjson", headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+
+@app.route("/validateHours", methods=["POST"])
+def validate_hours(
+) -> tuple:
+    """
+    Returns the validity and failed rules of each `{"base", "formatted"}` item, in order.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not all(isinstance(item, dict) and isinstance(item.get("base"), str) and isinstance(item.get("formatted"), str) for item in items):
+        abort(400, description="Request body must be a JSON array of objects with `base` and `formatted` strings.")
+    if len(items) > VALIDATE_MAX_SIZE:
+        abort(400, description=f"Request body must contain at most {VALIDATE_MAX_SIZE} items.")
+    return jsonify(validate_formatted_strings(items)), 200
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats(
+) -> tuple:
+    """
+    """
+    return jsonify({**RESULT_CACHE.stats(), **IN_FLIGHT_REQUESTS.stats()}), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics(
+) -> Response:
+    """
+    """
+    return Response(render_metrics(), status=200, mimetype="text/plain; version=0.0.4")
+
+@app.route("/jobs", methods=["POST"])
+def post_job(
+) -> tuple:
+    """
+    Accepts the bulk upload file as a multipart `file` field, or as the raw request body.
+    """
+    file = request.files.get("file")
+    data, file_name = (file.read(), file.filename) if file else (request.get_data(), request.args.get("fileName", ""))
+    try:
+        state = create_job(data, file_name)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return jsonify(state), 202, {"Location": f"/jobs/{state['id']}"}
+
+@app.route("/jobs/<jobId>", methods=["GET"])
+def job_status(
+    jobId: str,
+) -> tuple:
+    """
+    """
+    try:
+        state = get_job(jobId)
+    except JobNotFound as e:
+        abort(404, description=str(e))
+    return jsonify(state), 200
+
+@app.route("/jobs/<jobId>/result", methods=["GET"])
+def job_result(
+    jobId: str,
+) -> Response:
+    """
+    """
+    try:
+        path, file_name = get_job_result_path(jobId)
+    except JobNotFound as e:
+        abort(404, description=str(e))
+    except ValueError as e:
+        abort(409, description=str(e))
+    return send_file(os.path.abspath(path), mimetype="text/csv", as_attachment=True, download_name=file_name)
 
 
 # MAIN
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     app.run(debug=True, threaded=True)
@@ -0,0 +1,153 @@
+"""
+This module contains the cooperative cancellation of the normalizeHours server.
+
+The segments of an input string are formatted within a cancel scope, held in a context variable that `tracing.bind_context` carries into executor threads.
+A scope is cancelled once the outcome of its input string is decided: a segment's completion failed or cannot be valid,
+the scope's deadline passed, or the client disconnected from a streamed response.
+Segments check their scope with `check_cancelled` before they are sent upstream, so the remaining segments of a decided input string are discarded
+instead of being sent and paid for. Completions already in flight are not interrupted, and their results are discarded.
+"""
+
+
+# PACKAGE IMPORTS
+import contextvars
+import os
+import threading
+import time
+
+# LOCAL FILE IMPORTS
+from admission import UpstreamUnavailable
+from metrics import CANCELLED_SEGMENTS
+
+
+# MISC CONSTANTS
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+CURRENT_SCOPE = contextvars.ContextVar("current_cancel_scope", default=None)
+DEADLINE_EXCEEDED = "deadline_exceeded"
+SEGMENT_FAILED = "segment_failed"
+SEGMENT_INVALID = "segment_invalid"
+CLIENT_DISCONNECTED = "client_disconnected"
+
+
+
+
+# ERRORS
+class RequestCancelled(Exception):
+    """
+    Raised by work checking a cancelled scope, before it is sent upstream.
+    """
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    """
+    Raised when an input string is not formatted before its deadline.
+    """
+    status = 504
+
+
+
+
+# SCOPES
+class CancelScope:
+    """
+    Cancellation shared by the segments of an input string, with an optional deadline.
+    A scope is also cancelled when its parent is. Used as a context manager, it is the current scope until it exits.
+    """
+    def __init__(
+        self,
+        deadline_seconds: float = None,
+        parent: "CancelScope" = None,
+    ) -> None:
+        """
+        """
+        self.parent = parent
+        self.deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = parent.deadline if self.deadline is None else min(self.deadline, parent.deadline)
+        self.event = threading.Event()
+        self.reason = None
+        self.token = None
+
+    def cancel(
+        self,
+        reason: str,
+    ) -> None:
+        """
+        Cancels the scope, keeping the reason it was first cancelled for.
+        """
+        if not self.event.is_set():
+            self.reason = reason
+            self.event.set()
+
+    def cancelled(
+        self,
+    ) -> bool:
+        """
+        """
+        if self.event.is_set():
+            return True
+        if self.parent is not None and self.parent.cancelled():
+            self.cancel(self.parent.reason)
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+        return self.event.is_set()
+
+    def remaining(
+        self,
+    ) -> float:
+        """
+        Returns the seconds left before the deadline, or None if the scope has no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def __enter__(
+        self,
+    ) -> "CancelScope":
+        """
+        """
+        self.token = CURRENT_SCOPE.set(self)
+        return self
+
+    def __exit__(
+        self,
+        *_: any,
+    ) -> None:
+        """
+        """
+        CURRENT_SCOPE.reset(self.token)
+
+
+
+
+# HELPERS
+def current_scope(
+) -> CancelScope:
+    """
+    """
+    return CURRENT_SCOPE.get()
+
+
+def check_cancelled(
+) -> None:
+    """
+    Raises `RequestCancelled` if the current scope is cancelled, counting the discarded segment.
+    """
+    scope = CURRENT_SCOPE.get()
+    if scope is not None and scope.cancelled():
+        CANCELLED_SEGMENTS.inc(reason=scope.reason)
+        raise RequestCancelled(f"Cancelled before being sent upstream ({scope.reason}).")
+
+
+def cancel_futures(
+    futures: iter,
+    reason: str,
+) -> int:
+    """
+    Cancels the futures that have not started running, so their work is never dispatched, and returns the number cancelled.
+    """
+    cancelled = sum(1 for future in futures if future.cancel())
+    if cancelled:
+        CANCELLED_SEGMENTS.inc(cancelled, reason=reason)
+    return cancelled
@@ -0,0 +1,419 @@
+"""
+This module contains the asynchronous bulk job runner of the normalizeHours server.
+
+A job cleans the hours of an entire bulk upload file, the same way `clean_hours.py` does, in the background.
+Each job is kept in its own directory under `JOBS_DIRECTORY`:
+- `input.csv`: The uploaded bulk upload file.
+- `state.json`: The status and progress of the job.
+- `results.jsonl`: One normalized response per distinct input string, appended as each completes.
+- `<file name>_HOURS_CLEANED.csv`: The cleaned bulk upload file, written once the job is done.
+
+Because every completed response is appended to `results.jsonl`, a job interrupted by a restart is resumed where it stopped.
+"""
+
+
+# PACKAGE IMPORTS
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# LOCAL FILE IMPORTS
+from admission import UpstreamUnavailable
+from normalizeHours import normalize_input_string, UNCLEANED_HOURS_COLUMN
+from quotas import CURRENT_CLIENT
+from tracing import bind_context
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from hoursValidation import find_rejected_input_rules
+
+
+# MISC CONSTANTS
+JOBS_DIRECTORY = os.getenv("JOBS_DIRECTORY", "jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "50"))
+JOB_REQUEST_WORKERS = int(os.getenv("JOB_REQUEST_WORKERS", "2"))
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", "10"))
+PROGRAM_ID_COLUMN = "Program External ID"
+FORMATTED_HOURS_COLUMNS = 15
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+job_executor = None
+job_request_executor = None
+job_executor_lock = threading.Lock()
+
+
+
+
+# ERRORS
+class JobNotFound(Exception):
+    """
+    Raised when no job exists with the requested ID.
+    """
+
+
+
+
+# HELPERS
+def job_path(
+    job_id: str,
+    name: str = "",
+) -> str:
+    """
+    """
+    if not job_id or os.path.basename(job_id) != job_id or job_id.startswith("."):
+        raise JobNotFound(f"Job {job_id} does not exist.")
+    return os.path.join(JOBS_DIRECTORY, job_id, name)
+
+
+def read_state(
+    job_id: str,
+) -> dict:
+    """
+    """
+    try:
+        with open(job_path(job_id, "state.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        raise JobNotFound(f"Job {job_id} does not exist.")
+
+
+def write_state(
+    state: dict,
+) -> None:
+    """
+    Writes the state of a job atomically, so a concurrent reader never sees a partial file.
+    """
+    path = job_path(state["id"], "state.json")
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(state, file)
+    os.replace(temporary_path, path)
+
+
+def read_input(
+    job_id: str,
+) -> tuple:
+    """
+    Returns the header and rows of a job's bulk upload file.
+    """
+    with open(job_path(job_id, "input.csv"), newline="", encoding="utf-8") as file:
+        rows = list(csv.reader(file))
+    return rows[0], rows[1:]
+
+
+def read_results(
+    job_id: str,
+) -> dict:
+    """
+    Returns the completed responses of a job, keyed by input string. A partially written last line is ignored.
+    """
+    results = {}
+    try:
+        with open(job_path(job_id, "results.jsonl")) as file:
+            for line in file:
+                try:
+                    response = json.loads(line)
+                except ValueError:
+                    continue
+                results[response["base"]] = response
+    except OSError:
+        pass
+    return results
+
+
+def get_job_executor(
+) -> ThreadPoolExecutor:
+    """
+    Returns the job worker pool, creating it on first use so that a server that never runs a job never starts its workers.
+    """
+    global job_executor
+    with job_executor_lock:
+        if job_executor is None:
+            job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return job_executor
+
+
+def get_job_request_executor(
+) -> ThreadPoolExecutor:
+    """
+    Returns the pool normalizing the input strings of every job, creating it on first use.
+    It is kept apart from the `REQUEST_EXECUTOR` of interactive requests, and bounded to `JOB_REQUEST_WORKERS` input strings at once,
+    so that jobs never hold more than that many input strings' segments in the upstream admission queue, however large their uploads.
+    """
+    global job_request_executor
+    with job_executor_lock:
+        if job_request_executor is None:
+            job_request_executor = ThreadPoolExecutor(max_workers=JOB_REQUEST_WORKERS, thread_name_prefix="job-request")
+        return job_request_executor
+
+
+def hours_column_index(
+    header: list,
+) -> int:
+    """
+    Raises ValueError unless the header has the bulk upload columns a job needs.
+    """
+    for column in [PROGRAM_ID_COLUMN, UNCLEANED_HOURS_COLUMN]:
+        if column not in header:
+            raise ValueError(f"Bulk upload file must have a `{column}` column.")
+    if len(header) <= FORMATTED_HOURS_COLUMNS:
+        raise ValueError(f"Bulk upload file must have the {FORMATTED_HOURS_COLUMNS} formatted hours columns.")
+    return header.index(UNCLEANED_HOURS_COLUMN)
+
+
+def normalize_chunk(
+    cases: list,
+) -> iter:
+    """
+    Normalizes a chunk of input strings, yielding one response per case as each completes.
+    Cases refused by admission control or the circuit breaker are retried after their Retry-After, instead of being marked invalid.
+    Raises `UpstreamUnavailable` once cases have been retried `JOB_MAX_RETRIES` times and are still refused, failing the job.
+    """
+    pending = list(cases)
+    retries = 0
+    while pending:
+        normalize_client_input_string = bind_context(normalize_input_string)
+        futures = {get_job_request_executor().submit(normalize_client_input_string, case): case for case in pending}
+        pending = []
+        refusal = None
+        for future in as_completed(futures):
+            case = futures[future]
+            try:
+                yield future.result()
+            except UpstreamUnavailable as e:
+                pending.append(case)
+                refusal = e if refusal is None or e.retry_after > refusal.retry_after else refusal
+            except Exception as e:
+                yield {"base": case, "formatted": "", "isValid": False, "error": str(e)}
+        if not pending:
+            break
+        if retries == JOB_MAX_RETRIES:
+            raise UpstreamUnavailable(f"{len(pending)} input strings were still refused after {JOB_MAX_RETRIES} retries: {refusal}", refusal.retry_after)
+        retries += 1
+        time.sleep(refusal.retry_after)
+
+
+def convert_rows(
+    header: list,
+    rows: list,
+    hours_index: int,
+    results: dict,
+) -> list:
+    """
+    Converts the rows of a bulk upload file into cleaned rows, the same way `convert_id_hours_dict_to_df` does in `clean_hours.py`.
+    Each valid row is split into one row per formatted `;` entry, and invalid rows are kept as they are.
+    """
+    cleaned_rows = []
+    for row in rows:
+        response = results.get(row[hours_index].strip()) if hours_index < len(row) else None
+        if response is None or not response["isValid"]:
+            cleaned_rows.append(row)
+            continue
+        prefix = row[0:len(header) - FORMATTED_HOURS_COLUMNS]
+        for entry in response["formatted"].split(";"):
+            cleaned_row = prefix + entry.split(",") + [""]
+            cleaned_rows.append(cleaned_row if len(cleaned_row) == len(header) else prefix + [""] * FORMATTED_HOURS_COLUMNS)
+    return cleaned_rows
+
+
+def result_file_name(
+    state: dict,
+) -> str:
+    """
+    """
+    return os.path.basename(state["fileName"]).replace(".csv", "") + "_HOURS_CLEANED.csv"
+
+
+def lock_job(
+    job_id: str,
+) -> any:
+    """
+    Returns an open lock file held exclusively by this process, or None if another process is already running the job.
+    The lock is released when the file is closed, or when the process holding it dies.
+    """
+    file = open(job_path(job_id, "job.lock"), "w")
+    if fcntl is None:
+        return file
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        return None
+    return file
+
+
+
+
+# JOBS
+def create_job(
+    data: bytes,
+    file_name: str,
+) -> dict:
+    """
+    Stores an uploaded bulk upload file as a new job, queues it on the job worker pool, and returns its state.
+    Raises ValueError if the file is not a bulk upload CSV.
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("Bulk upload file must be UTF-8 encoded.")
+    rows = list(csv.reader(io.StringIO(text, newline="")))
+    if not rows:
+        raise ValueError("Bulk upload file is empty.")
+    hours_column_index(rows[0])
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_path(job_id))
+    with open(job_path(job_id, "input.csv"), "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerows(rows)
+    state = {
+        "id": job_id,
+        "fileName": os.path.basename(file_name or "bulk_upload.csv"),
+        "client": CURRENT_CLIENT.get(),
+        "status": QUEUED,
+        "rows": len(rows) - 1,
+        "rowsDone": 0,
+        "validRows": 0,
+        "invalidRows": 0,
+        "createdAt": time.time(),
+        "startedAt": None,
+        "finishedAt": None,
+        "error": None,
+    }
+    write_state(state)
+    get_job_executor().submit(run_job, job_id)
+    return state
+
+
+def get_job(
+    job_id: str,
+) -> dict:
+    """
+    Returns the state of a job, with the estimated number of seconds left while it is running.
+    """
+    state = read_state(job_id)
+    state["etaSeconds"] = None
+    rows_done_this_run = state["rowsDone"] - state.get("rowsDoneAtStart", 0)
+    if state["status"] == RUNNING and rows_done_this_run > 0:
+        seconds_per_row = (time.time() - state["startedAt"]) / rows_done_this_run
+        state["etaSeconds"] = round(seconds_per_row * (state["rows"] - state["rowsDone"]), 1)
+    state.pop("rowsDoneAtStart", None)
+    return state
+
+
+def get_job_result_path(
+    job_id: str,
+) -> tuple:
+    """
+    Returns the path and download name of a finished job's cleaned bulk upload file.
+    Raises JobNotFound if the job does not exist, and ValueError if it has not finished.
+    """
+    state = read_state(job_id)
+    if state["status"] != DONE:
+        raise ValueError(f"Job {job_id} is {state['status']}, not {DONE}.")
+    return job_path(job_id, result_file_name(state)), result_file_name(state)
+
+
+def run_job(
+    job_id: str,
+) -> None:
+    """
+    Cleans the hours of a job's bulk upload file, skipping the input strings already completed by an earlier run.
+    Progress is written to the job's state after every chunk of `JOB_CHUNK_SIZE` input strings.
+    """
+    lock = lock_job(job_id)
+    if lock is None:
+        return
+    # The state is read only once the lock is held, as the run that held it before may have finished the job since
+    try:
+        state = read_state(job_id)
+    except JobNotFound:
+        lock.close()
+        raise
+    try:
+        if state["status"] in [DONE, FAILED]:
+            return
+        # The job's upstream calls are charged to the client that created it
+        CURRENT_CLIENT.set(state.get("client", ""))
+        header, rows = read_input(job_id)
+        hours_index = hours_column_index(header)
+        cases = [row[hours_index].strip() if hours_index < len(row) else "" for row in rows]
+        rows_by_case = {}
+        for case in cases:
+            rows_by_case[case] = rows_by_case.get(case, 0) + 1
+        results = read_results(job_id)
+
+        # Rejected inputs (empty, "nan", run-on, or not hours at all) are never sent to the model, matching the input tests of `clean_hours.py`
+        for case in rows_by_case:
+            if case in results:
+                continue
+            rejected_rules = find_rejected_input_rules(case, early_exit=True)
+            if rejected_rules:
+                results[case] = {"base": case, "formatted": "", "isValid": False, "error": f"Input string was rejected by {rejected_rules[0]}."}
+
+        state["rowsDone"] = sum(rows_by_case[case] for case in results if case in rows_by_case)
+        state["validRows"] = sum(rows_by_case[case] for case, response in results.items() if case in rows_by_case and response["isValid"])
+        state["invalidRows"] = state["rowsDone"] - state["validRows"]
+        state["rowsDoneAtStart"] = state["rowsDone"]
+        state["status"] = RUNNING
+        state["startedAt"] = time.time()
+        write_state(state)
+
+        pending = [case for case in rows_by_case if case not in results]
+        with open(job_path(job_id, "results.jsonl"), "ab+") as results_file:
+            # Terminate a line left partially written by an interrupted run
+            if results_file.seek(0, os.SEEK_END) > 0:
+                results_file.seek(-1, os.SEEK_END)
+                if results_file.read(1) != b"\n":
+                    results_file.write(b"\n")
+            for start in range(0, len(pending), JOB_CHUNK_SIZE):
+                for response in normalize_chunk(pending[start:start + JOB_CHUNK_SIZE]):
+                    results[response["base"]] = response
+                    results_file.write((json.dumps(response) + "\n").encode())
+                    state["rowsDone"] += rows_by_case[response["base"]]
+                    state["validRows" if response["isValid"] else "invalidRows"] += rows_by_case[response["base"]]
+                results_file.flush()
+                write_state(state)
+
+        with open(job_path(job_id, result_file_name(state)), "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(convert_rows(header, rows, hours_index, results))
+        state["status"] = DONE
+    except Exception as e:
+        state["status"] = FAILED
+        state["error"] = str(e)
+    finally:
+        if state["status"] in [DONE, FAILED] and state["finishedAt"] is None:
+            state["finishedAt"] = time.time()
+        write_state(state)
+        lock.close()
+
+
+def resume_jobs(
+) -> int:
+    """
+    Queues every job left queued or running by an earlier server process, and returns the number of jobs queued.
+    """
+    if not os.path.isdir(JOBS_DIRECTORY):
+        return 0
+    job_ids = []
+    for job_id in sorted(os.listdir(JOBS_DIRECTORY)):
+        try:
+            if read_state(job_id)["status"] in [QUEUED, RUNNING]:
+                job_ids.append(job_id)
+        except JobNotFound:
+            continue
+    for job_id in job_ids:
+        get_job_executor().submit(run_job, job_id)
+    return len(job_ids)
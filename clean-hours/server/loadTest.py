@@ -0,0 +1,317 @@
+"""
+Load Test Script
+
+This script measures the throughput and latency of the normalizeHours server, without calling Azure OpenAI.
+A mock completion backend is started locally, imitating the Azure OpenAI completions endpoint with a configurable latency and error rate.
+The server is then started against the mock backend (or an already running server is targeted), and driven at a fixed concurrency with realistic hour strings.
+
+---> OPERATIONAL INSTRUCTIONS <---
+
+Instructions:
+    1) Install the server requirements (`pip install -r requirements.txt`).
+    2) Run the following command within the terminal: `python loadTest.py --concurrency 16 --requests 2000`.
+        a) `--segments "1:0.6,2:0.3,5:0.1"` sets the mix of segment counts per request.
+        b) `--repeat-ratio 0.5` sets the share of requests repeating an earlier input string.
+        c) `--mock-latency 0.3 --mock-jitter 0.1 --mock-error-rate 0.01` configures the mock backend.
+        d) `--server prefork` starts the production server in `serve.py` instead of the Flask development server.
+        e) `--target http://localhost:8000` drives an already running server instead of starting one.
+           That server must be started with `OAI_BASE` set to the printed mock backend URL, and `--mock-port` fixed.
+
+Desired Output:
+    * The throughput (requests per second), error counts by status, and the p50/p95/p99 latencies of the run.
+"""
+
+
+# PACKAGE IMPORTS
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# MISC CONSTANTS
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+ORDINALS = ["1st", "2nd", "3rd", "4th"]
+HOUR_TEMPLATES = [
+    "Every {day} {open}-{close}",
+    "{day}s from {open} until {close}",
+    "{ordinal} {day} of the month, {open} to {close}",
+    "Every other {day}, {open} - {close}",
+    "{day} {open}-{close}",
+]
+SERVER_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+
+
+# MOCK BACKEND
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    """
+    Imitates the Azure OpenAI completions endpoint, answering each prompt with a well-formed hour entry after a simulated latency.
+    """
+    latency = 0.3
+    jitter = 0.1
+    error_rate = 0.0
+    calls = 0
+    prompts = 0
+    lock = threading.Lock()
+
+    def do_POST(
+        self,
+    ) -> None:
+        """
+        """
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if random.random() < self.error_rate:
+            status = random.choice([429, 500])
+            self.send_json(status, {"error": {"message": "Injected mock error", "type": "mock", "code": str(status)}}, {"Retry-After": "1"})
+            return
+        prompts = body.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        with MockCompletionHandler.lock:
+            MockCompletionHandler.calls += 1
+            MockCompletionHandler.prompts += len(prompts)
+        choices = [{"text": mock_completion(prompt), "index": index, "finish_reason": "stop", "logprobs": None} for index, prompt in enumerate(prompts)]
+        usage = {"prompt_tokens": sum(len(prompt) // 4 for prompt in prompts), "completion_tokens": 12 * len(prompts)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.send_json(200, {"id": "mock", "object": "text_completion", "model": "mock", "choices": choices, "usage": usage})
+
+    def send_json(
+        self,
+        status: int,
+        body: dict,
+        headers: dict = {},
+    ) -> None:
+        """
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(
+        self,
+        *_: any,
+    ) -> None:
+        """
+        """
+        return
+
+
+def mock_completion(
+    prompt: str,
+) -> str:
+    """
+    Builds a well-formed hour entry from the first day and the first two times found in the prompt.
+    """
+    day = next((day for day in DAYS_OF_WEEK if day.lower() in prompt.lower()), "Monday")
+    times = [int(hour) % 12 + (12 if meridiem.lower() == "pm" else 0) for hour, meridiem in re.findall(r"(\d{1,2})\s*(am|pm)", prompt, re.IGNORECASE)]
+    open_hour, close_hour = (times + [9, 11])[0:2]
+    if close_hour <= open_hour:
+        close_hour = min(open_hour + 2, 23)
+    return f"{day},{open_hour}:00,{close_hour}:00,,,,,,,,Weekly,,,"
+
+
+def start_mock_backend(
+    port: int,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+) -> ThreadingHTTPServer:
+    """
+    """
+    MockCompletionHandler.latency = latency
+    MockCompletionHandler.jitter = jitter
+    MockCompletionHandler.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockCompletionHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+
+
+# LOAD GENERATOR
+def random_hours(
+    segments: int,
+) -> str:
+    """
+    Builds a realistic input string with the given number of `;` segments.
+    """
+    values = []
+    for _ in range(segments):
+        open_hour = random.randint(7, 13)
+        close_hour = open_hour + random.randint(1, 5)
+        values.append(random.choice(HOUR_TEMPLATES).format(
+            day=random.choice(DAYS_OF_WEEK),
+            ordinal=random.choice(ORDINALS),
+            open=f"{(open_hour - 1) % 12 + 1}{'am' if open_hour < 12 else 'pm'}",
+            close=f"{(close_hour - 1) % 12 + 1}{'am' if close_hour < 12 else 'pm'}",
+        ))
+    return "; ".join(values)
+
+
+def parse_segment_mix(
+    mix: str,
+) -> tuple:
+    """
+    Parses a segment mix such as "1:0.6,2:0.3,5:0.1" into lists of segment counts and their weights.
+    """
+    pairs = [pair.split(":") for pair in mix.split(",")]
+    return [int(segments) for segments, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+def wait_for_server(
+    target: str,
+    timeout: float,
+) -> None:
+    """
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(target + "/", timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise TimeoutError(f"Server at {target} did not start within {timeout} seconds.")
+
+
+def run_load(
+    target: str,
+    concurrency: int,
+    total_requests: int,
+    segment_mix: str,
+    repeat_ratio: float,
+) -> tuple:
+    """
+    Sends `total_requests` requests from `concurrency` threads, returning the `(latency, status)` of each request and the wall time of the run.
+    """
+    segment_counts, weights = parse_segment_mix(segment_mix)
+    sent_hours = []
+    results = []
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker() -> None:
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+                if sent_hours and random.random() < repeat_ratio:
+                    hours = random.choice(sent_hours)
+                else:
+                    hours = random_hours(random.choices(segment_counts, weights)[0])
+                    sent_hours.append(hours)
+            start_time = time.perf_counter()
+            try:
+                with urllib.request.urlopen(target + "/normalizeHours/" + urllib.parse.quote(hours, safe=""), timeout=120) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception as e:
+                status = type(e).__name__
+            with lock:
+                results.append((time.perf_counter() - start_time, status))
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    return results, time.perf_counter() - start_time
+
+
+def percentile(
+    values: list,
+    percent: float,
+) -> float:
+    """
+    Returns the nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(percent / 100 * len(values))) - 1))]
+
+
+def print_report(
+    results: list,
+    wall_time: float,
+) -> None:
+    """
+    """
+    latencies = sorted(latency for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print("Requests:\t" + str(len(results)))
+    print("Wall Time:\t" + f"{wall_time:.2f}s")
+    print("Throughput:\t" + f"{len(results) / wall_time:.1f} req/s")
+    print("Statuses:\t" + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print("Latency p50:\t" + f"{percentile(latencies, 50) * 1000:.1f}ms")
+    print("Latency p95:\t" + f"{percentile(latencies, 95) * 1000:.1f}ms")
+    print("Latency p99:\t" + f"{percentile(latencies, 99) * 1000:.1f}ms")
+    print("Latency max:\t" + f"{(latencies[-1] if latencies else 0) * 1000:.1f}ms")
+
+
+
+
+# MAIN
+if __name__ == "__main__":
+    # Define console parser
+    parser = argparse.ArgumentParser(description="Measure the throughput and latency of the normalizeHours server against a mock completion backend")
+    parser.add_argument("--target", action="store", default=None, help="URL of an already running server (default: start a server against the mock backend)")
+    parser.add_argument("--server", action="store", choices=["flask", "prefork"], default="flask", help="Server to start: the Flask development server, or the pre-fork server in serve.py")
+    parser.add_argument("--port", action="store", type=int, default=5000, help="Port of the started server")
+    parser.add_argument("--concurrency", action="store", type=int, default=16, help="Number of concurrent clients")
+    parser.add_argument("--requests", action="store", type=int, default=1000, help="Total number of requests to send")
+    parser.add_argument("--segments", action="store", default="1:0.6,2:0.3,5:0.1", help="Mix of segment counts per request, as count:weight pairs")
+    parser.add_argument("--repeat-ratio", action="store", type=float, default=0.3, help="Share of requests repeating an earlier input string")
+    parser.add_argument("--mock-port", action="store", type=int, default=0, help="Port of the mock completion backend (default: any free port)")
+    parser.add_argument("--mock-latency", action="store", type=float, default=0.3, help="Mean latency of the mock backend, in seconds")
+    parser.add_argument("--mock-jitter", action="store", type=float, default=0.1, help="Standard deviation of the mock backend latency, in seconds")
+    parser.add_argument("--mock-error-rate", action="store", type=float, default=0.0, help="Share of mock completions failing with a 429 or 500")
+    args = parser.parse_args()
+
+    # Start Mock Backend
+    mock_backend = start_mock_backend(args.mock_port, args.mock_latency, args.mock_jitter, args.mock_error_rate)
+    mock_url = f"http://127.0.0.1:{mock_backend.server_address[1]}"
+    print("Mock completion backend running at " + mock_url)
+
+    # Start Server
+    server_process = None
+    target = args.target
+    if target is None:
+        environment = dict(os.environ, OAI_BASE=mock_url, OAI_KEY="mock", OAI_ENGINE="mock", CACHE_SNAPSHOT_PATH="", SERVER_BIND=f"127.0.0.1:{args.port}")
+        if args.server == "prefork":
+            command = [sys.executable, "serve.py"]
+        else:
+            command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(args.port), "--with-threads"]
+        server_process = subprocess.Popen(command, cwd=SERVER_DIRECTORY, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        target = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_for_server(target, 30)
+        print(f"Sending {args.requests} requests to {target} from {args.concurrency} clients...")
+        results, wall_time = run_load(target, args.concurrency, args.requests, args.segments, args.repeat_ratio)
+        print_report(results, wall_time)
+        print("Mock Calls:\t" + f"{MockCompletionHandler.calls} ({MockCompletionHandler.prompts} prompts, {MockCompletionHandler.calls / wall_time * 60:.0f} calls/min)")
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+        mock_backend.shutdown()
@@ -0,0 +1,218 @@
+"""
+This module contains the operational metrics of the normalizeHours server, rendered in the Prometheus text exposition format.
+
+The metrics are implemented without any third-party client library.
+Every metric created in this module is registered in `REGISTRY`, and rendered by `render_metrics` for the `/metrics` endpoint.
+"""
+
+
+# PACKAGE IMPORTS
+import bisect
+import threading
+
+
+# MISC CONSTANTS
+REGISTRY = []
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+SEGMENT_BUCKETS = [1, 2, 3, 4, 5, 7, 10, 15, 20]
+
+
+
+
+# METRICS
+class Metric:
+    """
+    A named metric with a fixed set of label names, holding one value per combination of label values.
+    Metrics created with a `function` have no labels, and read their value from the function each time the metrics are rendered.
+    """
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        function: callable = None,
+    ) -> None:
+        """
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def label_values(
+        self,
+        labels: dict,
+    ) -> tuple:
+        """
+        """
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def samples(
+        self,
+    ) -> list:
+        """
+        Returns the `(suffix, label values, extra labels, value)` samples of the metric.
+        """
+        if self.function is not None:
+            return [("", (), {}, self.function())]
+        with self.lock:
+            return [("", label_values, {}, value) for label_values, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    """
+    A value that only increases.
+    """
+    type = "counter"
+
+    def inc(
+        self,
+        amount: float = 1,
+        **labels: str,
+    ) -> None:
+        """
+        """
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can increase and decrease.
+    """
+    type = "gauge"
+
+    def inc(
+        self,
+        amount: float = 1,
+        **labels: str,
+    ) -> None:
+        """
+        """
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(
+        self,
+        amount: float = 1,
+        **labels: str,
+    ) -> None:
+        """
+        """
+        self.inc(-amount, **labels)
+
+    def set(
+        self,
+        value: float,
+        **labels: str,
+    ) -> None:
+        """
+        """
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values, counted into cumulative buckets.
+    """
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: list = LATENCY_BUCKETS,
+    ) -> None:
+        """
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+
+    def observe(
+        self,
+        value: float,
+        **labels: str,
+    ) -> None:
+        """
+        """
+        key = self.label_values(labels)
+        with self.lock:
+            bucket_counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (bucket_counts, total + value)
+
+    def samples(
+        self,
+    ) -> list:
+        """
+        """
+        samples = []
+        with self.lock:
+            for label_values, (bucket_counts, total) in sorted(self.values.items()):
+                cumulative_count = 0
+                for bound, count in zip(self.buckets + [float("inf")], bucket_counts):
+                    cumulative_count += count
+                    samples.append(("_bucket", label_values, {"le": format_value(bound)}, cumulative_count))
+                samples.append(("_sum", label_values, {}, total))
+                samples.append(("_count", label_values, {}, cumulative_count))
+        return samples
+
+
+
+
+# HELPERS
+def format_value(
+    value: float,
+) -> str:
+    """
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(
+    value: str,
+) -> str:
+    """
+    """
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_metrics(
+) -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, label_values, extra_labels, value in metric.samples():
+            labels = list(zip(metric.labels, label_values)) + list(extra_labels.items())
+            label_string = ",".join(f"{label}=\"{escape_label_value(label_value)}\"" for label, label_value in labels)
+            lines.append(f"{metric.name}{suffix}{{{label_string}}} {format_value(value)}" if label_string else f"{metric.name}{suffix} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+
+
+# SERVER METRICS
+REQUEST_LATENCY = Histogram("normalize_hours_request_duration_seconds", "Time spent handling each request, by route.", ("route", "method", "status"))
+REQUESTS_IN_FLIGHT = Gauge("normalize_hours_requests_in_flight", "Number of requests currently being handled.")
+UPSTREAM_LATENCY = Histogram("normalize_hours_upstream_duration_seconds", "Time spent waiting on each upstream completion call, one per segment or micro-batch.")
+UPSTREAM_ERRORS = Counter("normalize_hours_upstream_errors_total", "Number of failed upstream completions, by HTTP status or error type.", ("status",))
+SEGMENTS_PER_REQUEST = Histogram("normalize_hours_segments_per_request", "Number of ';' segments in each formatted input string.", buckets=SEGMENT_BUCKETS)
+CANCELLED_SEGMENTS = Counter("normalize_hours_cancelled_segments_total", "Number of segments discarded before being sent upstream because their input string was already decided, by reason.", ("reason",))
+VALIDATION_FAILURES = Counter("normalize_hours_validation_failures_total", "Number of formatted input strings failing each validation test, counted against the first failing test.", ("rule",))
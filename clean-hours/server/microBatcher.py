@@ -0,0 +1,138 @@
+"""
+This module contains the micro-batcher used by the normalizeHours server to merge concurrent upstream calls.
+
+Items submitted within a short window of each other, or until the batch is full, are sent together through a single call of the batch function.
+Each submitting thread waits for its own result. If the batch function cannot split its answer cleanly, it raises `BatchSplitError`,
+and each submitting thread falls back to calling the fallback function (by default, the single-item function) itself.
+"""
+
+
+# PACKAGE IMPORTS
+import threading
+from concurrent.futures import Future
+
+# LOCAL FILE IMPORTS
+from tracing import bind_context
+
+
+# MISC CONSTANTS
+BATCH_FALLBACK = object()
+
+
+
+
+# ERRORS
+class BatchSplitError(Exception):
+    """
+    Raised by a batch function when its answer cannot be split into one result per item.
+    """
+
+
+
+
+# MICRO-BATCHER
+class MicroBatcher:
+    """
+    Collects items for up to `window_seconds` or `max_size` items, whichever comes first, and processes them with one call of `batch_function`.
+    """
+    def __init__(
+        self,
+        window_seconds: float,
+        max_size: int,
+        batch_function: callable,
+        single_function: callable,
+        fallback_function: callable = None,
+    ) -> None:
+        """
+        """
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self.batch_function = batch_function
+        self.single_function = single_function
+        self.fallback_function = fallback_function or single_function
+        self.lock = threading.Lock()
+        self.pending = []
+        self.batches = 0
+        self.batched_items = 0
+        self.fallbacks = 0
+
+    def submit(
+        self,
+        item: any,
+    ) -> any:
+        """
+        Returns the result for the item, once the batch it joined has been processed.
+        """
+        future = Future()
+        with self.lock:
+            self.pending.append((item, future))
+            batch = self.take_batch() if len(self.pending) >= self.max_size else None
+            is_first = len(self.pending) == 1
+        if batch is not None:
+            self.run_batch(batch)
+        elif is_first:
+            # The window timer is started on demand, so no thread exists until the first item is submitted
+            # It runs in the first item's context, so the batch call is traced as part of the first item's request
+            # The batch function must not attribute the call itself to that request, as it carries every item of the batch
+            timer = threading.Timer(self.window_seconds, bind_context(self.flush))
+            timer.daemon = True
+            timer.start()
+        result = future.result()
+        if result is BATCH_FALLBACK:
+            return self.fallback_function(item)
+        return result
+
+    def take_batch(
+        self,
+    ) -> list:
+        """
+        Takes every pending item. Must be called while holding the lock.
+        """
+        batch, self.pending = self.pending, []
+        return batch
+
+    def flush(
+        self,
+    ) -> None:
+        """
+        Processes the pending items, if the batch they form has not already been processed for being full.
+        """
+        with self.lock:
+            batch = self.take_batch()
+        if batch:
+            self.run_batch(batch)
+
+    def run_batch(
+        self,
+        batch: list,
+    ) -> None:
+        """
+        """
+        items = [item for item, _ in batch]
+        try:
+            results = self.batch_function(items) if len(items) > 1 else [self.single_function(items[0])]
+        except BatchSplitError:
+            with self.lock:
+                self.fallbacks += len(items)
+            [future.set_result(BATCH_FALLBACK) for _, future in batch]
+            return
+        except BaseException as e:
+            [future.set_exception(e) for _, future in batch]
+            return
+        with self.lock:
+            self.batches += 1
+            self.batched_items += len(items)
+        [future.set_result(result) for (_, future), result in zip(batch, results)]
+
+    def stats(
+        self,
+    ) -> dict:
+        """
+        """
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "batchedItems": self.batched_items,
+                "savedCalls": self.batched_items - self.batches,
+                "fallbacks": self.fallbacks,
+            }
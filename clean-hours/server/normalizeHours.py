@@ -5,50 +5,166 @@
 # PACKAGE IMPORTS
 import openai
 import os
-import re
-from datetime import datetime
+import sys
 import time
+import hashlib
+import json
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from collections import Counter
 
 # LOCAL FILE IMPORTS
+from resultCache import ResultCache, SingleFlight
+from metrics import Counter as MetricCounter, Gauge, SEGMENTS_PER_REQUEST, UPSTREAM_ERRORS, UPSTREAM_LATENCY, VALIDATION_FAILURES
+from admission import AdmissionController, AdmissionRejected, CircuitBreaker, UpstreamUnavailable
+from microBatcher import BatchSplitError, MicroBatcher
+from tracing import bind_context, start_span
+from quotas import check_tokens, charge_tokens, CURRENT_CLIENT
+from cancellation import cancel_futures, check_cancelled, current_scope, CancelScope, DeadlineExceeded, REQUEST_DEADLINE_SECONDS, CLIENT_DISCONNECTED, DEADLINE_EXCEEDED, SEGMENT_FAILED, SEGMENT_INVALID
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from hoursValidation import find_failed_rules, find_failed_rules_batch, ENTRY_RULE_NAMES
 
 
 # AI CONSTANTS
 from dotenv import load_dotenv
 load_dotenv()
+openai.api_type = "azure"
+openai.api_base = os.getenv("OAI_BASE")
+openai.api_version = "2023-09-15-preview"
+openai.api_key = os.getenv("OAI_KEY")
 
 # MISC CONSTANTS
-INT_TO_DAY_OF_MONTH = {"1": ["1st", "First"], "2": ["2nd", "Second"], "3": ["3rd", "Third"], "4": ["4th", "Fourth"], "5": ["5th", "Fifth"], "": ""}
-DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-HOUR_TYPES = ["Weekly", "Every Other Week", "Day of Month", "Week of Month", "Call for Information"]
 UNCLEANED_HOURS_COLUMN = "Hours Uncleaned"
 INVALID_CHARACTERS = ""
 
+# CONCURRENCY CONSTANTS
+REQUEST_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("REQUEST_WORKERS", "8")))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1000"))
+VALIDATE_MAX_SIZE = int(os.getenv("VALIDATE_MAX_SIZE", "50000"))
+
+# CACHE CONSTANTS
+RESULT_CACHE = ResultCache(int(os.getenv("CACHE_MAX_ENTRIES", "10000")), float(os.getenv("CACHE_TTL_SECONDS", "86400")))
+PARTIAL_CACHE_TTL_SECONDS = float(os.getenv("PARTIAL_CACHE_TTL_SECONDS", "60"))
+CACHE_SNAPSHOT_PATH = os.getenv("CACHE_SNAPSHOT_PATH", "cache_snapshot.json")
+IN_FLIGHT_REQUESTS = SingleFlight()
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+CACHE_HIT_RATIO = Gauge("normalize_hours_cache_hit_ratio", "Ratio of result cache lookups that were hits.", function=lambda: RESULT_CACHE.stats()["hitRatio"])
+COALESCED_REQUESTS = MetricCounter("normalize_hours_coalesced_requests_total", "Number of requests that waited on an identical in-flight computation.", function=lambda: IN_FLIGHT_REQUESTS.stats()["coalesced"])
+
+# UPSTREAM CONSTANTS
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "30"))
+UPSTREAM_ADMISSION = AdmissionController(
+    int(os.getenv("UPSTREAM_MAX_CONCURRENT", "16")),
+    int(os.getenv("UPSTREAM_MAX_QUEUE", "64")),
+    float(os.getenv("UPSTREAM_QUEUE_TIMEOUT_SECONDS", "5")),
+    float(os.getenv("UPSTREAM_RETRY_AFTER_SECONDS", "2")),
+)
+UPSTREAM_CIRCUIT = CircuitBreaker(
+    int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+    float(os.getenv("CIRCUIT_WINDOW_SECONDS", "10")),
+    float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+)
+UPSTREAM_QUEUE_DEPTH = Gauge("normalize_hours_upstream_queue_depth", "Number of segments waiting for an upstream admission slot.", function=lambda: UPSTREAM_ADMISSION.waiting)
+UPSTREAM_REJECTIONS = MetricCounter("normalize_hours_upstream_rejections_total", "Number of requests and segments rejected by upstream admission control.", function=lambda: UPSTREAM_ADMISSION.rejected)
+MICRO_BATCH_WINDOW_SECONDS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "0")) / 1000
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "16"))
+MICRO_BATCH_CLIENT = "micro-batcher"
+UPSTREAM_BATCHER = MicroBatcher(MICRO_BATCH_WINDOW_SECONDS, MICRO_BATCH_MAX_SIZE, lambda prompts: call_upstream_batch(prompts), lambda prompt: call_upstream(prompt), lambda prompt: call_upstream(prompt, attempt=2)) if MICRO_BATCH_WINDOW_SECONDS > 0 else None
+UPSTREAM_SAVED_CALLS = MetricCounter("normalize_hours_upstream_calls_saved_total", "Number of upstream calls saved by merging segments into micro-batches.", function=lambda: UPSTREAM_BATCHER.stats()["savedCalls"] if UPSTREAM_BATCHER else 0)
+UPSTREAM_BATCH_FALLBACKS = MetricCounter("normalize_hours_upstream_batch_fallbacks_total", "Number of micro-batched segments retried individually because the batched answer could not be split.", function=lambda: UPSTREAM_BATCHER.stats()["fallbacks"] if UPSTREAM_BATCHER else 0)
+UPSTREAM_CIRCUIT_OPEN = Gauge("normalize_hours_upstream_circuit_open", "Whether the upstream circuit breaker is open (1), half-open (0.5) or closed (0).", function=lambda: {"open": 1, "half_open": 0.5}.get(UPSTREAM_CIRCUIT.state, 0))
+
 
 
 
 # HELPERS
-def call_oai(prompt: str) -> str:
-    """
-    """
-    openai.api_type = "azure"
-    openai.api_base = os.getenv("OAI_BASE")
-    openai.api_version = "2023-09-15-preview"
-    openai.api_key = os.getenv("OAI_KEY")
-    response = openai.Completion.create(
-        engine=os.getenv("OAI_ENGINE"),
-        prompt=f"{prompt}",
-        temperature=0.2,
-        max_tokens=256,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0,
-        best_of=1,
-        stop=["%%"]
-    )
-    time.sleep(0.05)
+def call_oai(prompt: str, attempt: int = 1) -> str:
+    """
+    """
+    response = create_completion(f"{prompt}", attempt)
     return response["choices"][0]["text"]
 
 
+def call_oai_batch(prompts: list, attempt: int = 1) -> list:
+    """
+    Sends several prompts in a single completion call, and returns one completion per prompt, in order.
+    Raises `BatchSplitError` if the response does not hold exactly one choice per prompt.
+    """
+    response = create_completion([f"{prompt}" for prompt in prompts], attempt)
+    choices = sorted(response["choices"], key=lambda choice: choice["index"])
+    if [choice["index"] for choice in choices] != list(range(len(prompts))):
+        raise BatchSplitError(f"Expected {len(prompts)} choices, received {len(choices)}.")
+    return [choice["text"] for choice in choices]
+
+
+def create_completion(prompt: any, attempt: int) -> dict:
+    """
+    """
+    start_time = time.perf_counter()
+    with start_span("call_oai", attempt=attempt, prompts=len(prompt) if isinstance(prompt, list) else 1, client=CURRENT_CLIENT.get()) as span:
+        try:
+            response = openai.Completion.create(
+                engine=os.getenv("OAI_ENGINE"),
+                prompt=prompt,
+                temperature=0.2,
+                max_tokens=256,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0,
+                best_of=1,
+                stop=["%%"],
+                request_timeout=UPSTREAM_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(status=getattr(e, "http_status", None) or type(e).__name__)
+            raise
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start_time)
+        usage = response.get("usage") or {}
+        span.set_attribute("promptTokens", usage.get("prompt_tokens"))
+        span.set_attribute("completionTokens", usage.get("completion_tokens"))
+    time.sleep(0.05)
+    return response
+
+
+def call_upstream(prompt: any, attempt: int = 1) -> any:
+    """
+    Calls the model through the circuit breaker, raising `UpstreamUnavailable` when the call is refused.
+    Throttling, server and connection errors count as upstream failures; any other response shows the upstream is healthy.
+    A list of prompts is sent as a single batched call.
+    """
+    UPSTREAM_CIRCUIT.before_call()
+    try:
+        response = call_oai_batch(prompt, attempt) if isinstance(prompt, list) else call_oai(prompt, attempt)
+    except BatchSplitError:
+        UPSTREAM_CIRCUIT.record_success()
+        raise
+    except Exception as e:
+        status = getattr(e, "http_status", None)
+        if status is None or status == 429 or status >= 500:
+            UPSTREAM_CIRCUIT.record_failure()
+        else:
+            UPSTREAM_CIRCUIT.record_success()
+        raise
+    except BaseException:
+        UPSTREAM_CIRCUIT.release_probe()
+        raise
+    UPSTREAM_CIRCUIT.record_success()
+    return response
+
+
+def call_upstream_batch(prompts: list) -> list:
+    """
+    Sends a micro-batch of segments, which may belong to several clients, under the micro-batcher's own client identity
+    rather than that of the client whose segment opened or filled the batch.
+    Each segment holds its own client's admission slot while it waits, and its tokens are charged to its own client by `format_segment`.
+    """
+    token = CURRENT_CLIENT.set(MICRO_BATCH_CLIENT)
+    try:
+        return call_upstream(prompts)
+    finally:
+        CURRENT_CLIENT.reset(token)
+
+
 def postprocess_string(case: str) -> str:
     """
     """
@@ -66,218 +182,269 @@ def preprocess_string(case: str) -> str:
     return case.strip().replace("/", ", ")
 
 
-def format_input_string(case: str) -> dict:
+def canonicalize_input_string(case: str) -> str:
     """
+    Collapses the whitespace within and around each segment, so equivalent input strings share a cache entry.
     """
-    case.replace("/", ", ")
-    split_value = case.split(";")
-    response = map(lambda x: postprocess_string(call_oai(preprocess_string(x))), split_value)
-    new_value = ";".join(response)
-    response = {
-        "base": case,
-        "formatted": new_value,
-        "isValid": True
-    }
-    return response
+    return ";".join(" ".join(segment.split()) for segment in case.split(";"))
 
 
-# TESTS
-def test_valid_day_of_week(response: dict) -> None:
+def cache_key(case: str) -> tuple:
     """
+    Returns the result cache key of an input string: its canonical form, the model engine and the model version.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            response["isValid"] = value[0] in DAYS_OF_WEEK or (value[0] == "" and value[10] == "Call for Information") and response["isValid"]
-        except:
-            response["isValid"] = False
-    return
+    return (canonicalize_input_string(case), os.getenv("OAI_ENGINE", ""), MODEL_VERSION)
 
 
-def test_valid_entry_format(response: dict) -> None:
+def response_etag(case: str) -> str:
     """
+    Returns a deterministic entity tag for the normalized response of an input string, derived from its cache key.
     """
-    if response["isValid"] == False:
-        return
-    count_semicolons = response["formatted"].count(";")
-    count_commas = response["formatted"].count(",")
-    is_valid = 13 + count_semicolons * 13 == count_commas
-    is_valid = (count_semicolons < 1 and count_commas == 13) or (count_semicolons >= 1 and count_commas > 13) and is_valid
-    response["isValid"] = response["isValid"] and is_valid
-    return
+    return hashlib.sha256(json.dumps(cache_key(case)).encode()).hexdigest()[0:32]
 
 
-def test_valid_open_closed_hours(response: dict) -> None:
+def format_segment(case: str) -> str:
     """
+    Segments are merged into batched upstream calls by the micro-batcher, when it is enabled.
+    The estimated tokens of each segment are charged to the current client's quota, even when the segment is sent in a micro-batch.
+    Raises `RequestCancelled` instead of sending the segment upstream once its input string is decided.
     """
-    if response["isValid"] == False:
-        return
-    time_regex = re.compile("^([01]?[0-9]|2[0-3]):[0-5][0-9]$")
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        if value[10] == "Call for Information":
-            continue
-        try:
-            is_open_hour_valid = re.search(time_regex, value[1])
-            is_closed_hour_valid = re.search(time_regex, value[2])
-            is_valid = (is_open_hour_valid != None or value[1] == "") and (is_closed_hour_valid != None or value[2] == "") and is_valid
-        except:
-            is_valid = False
-        response["isValid"] = response["isValid"] and is_valid
-    return
-            
+    with start_span("format_segment", segment=case):
+        prompt = preprocess_string(case)
+        check_cancelled()
+        check_tokens()
+        response = UPSTREAM_BATCHER.submit(prompt) if UPSTREAM_BATCHER is not None else call_upstream(prompt)
+        charge_tokens(prompt, response)
+        with start_span("postprocess_string"):
+            return postprocess_string(response)
 
-def test_close_hour_greater_than_open_hour(response: dict) -> None:
+
+def format_input_string(case: str) -> dict:
     """
+    Segments are formatted concurrently in upstream admission slots, shared fairly with the other clients' segments, and joined in their original order.
+    They are admitted together, so the input string fails fast with `AdmissionRejected` when the admission queue is full.
+    Once a segment's completion fails, or its entries fail a rule that no other segment can fix, the segments not yet sent upstream are cancelled.
+    An input string decided invalid this way is returned with the rule under `failedRule`, and with `partial` set if segments were cancelled,
+    whose entries are left empty in `formatted`.
+    Raises `DeadlineExceeded` if the segments are not formatted within `REQUEST_DEADLINE_SECONDS`.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
+    case.replace("/", ", ")
+    split_value = case.split(";")
+    SEGMENTS_PER_REQUEST.observe(len(split_value))
+    formatted_segments = [""] * len(split_value)
+    formatted_count = 0
+    failed_rule = None
+    with start_span("format_input_string", segments=len(split_value)) as span, CancelScope(REQUEST_DEADLINE_SECONDS, current_scope()) as scope:
+        format_scoped_segment = bind_context(format_segment)
+        segment_futures = UPSTREAM_ADMISSION.submit_all([(format_scoped_segment, segment) for segment in split_value], CURRENT_CLIENT.get())
+        futures = {future: index for index, future in enumerate(segment_futures)}
         try:
-            is_valid = datetime.strptime(value[2], "%H:%M") > datetime.strptime(value[1], "%H:%M") and is_valid
-        except ValueError:
-            is_valid = value[10] == "Call for Information" and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return 
+            for future in as_completed(futures, timeout=scope.remaining()):
+                index = futures[future]
+                formatted_segments[index] = future.result()
+                formatted_count += 1
+                failed_rules = find_failed_rules(split_value[index], formatted_segments[index], early_exit=True, rule_names=ENTRY_RULE_NAMES)
+                if failed_rules:
+                    failed_rule = failed_rules[0]
+                    scope.cancel(SEGMENT_INVALID)
+                    break
+        except Exception as e:
+            if isinstance(e, TimeoutError) or scope.cancelled() and scope.reason == DEADLINE_EXCEEDED:
+                scope.cancel(DEADLINE_EXCEEDED)
+                raise DeadlineExceeded(f"The input string was not formatted within {REQUEST_DEADLINE_SECONDS:g} seconds.", UPSTREAM_ADMISSION.retry_after) from e
+            scope.cancel(SEGMENT_FAILED)
+            raise
+        finally:
+            if scope.cancelled():
+                cancel_futures(futures, scope.reason)
+                span.set_attribute("cancelled", scope.reason)
+    response = {
+        "base": case,
+        "formatted": ";".join(formatted_segments),
+        "isValid": failed_rule is None
+    }
+    if failed_rule is not None:
+        response["failedRule"] = failed_rule
+    if formatted_count < len(split_value):
+        response["partial"] = True
+    return response
 
 
-def test_day_of_month_formatting(response: dict) -> None:
+def trace_rule(name: str, check: callable) -> bool:
     """
+    Checks a validation rule under a span named after it, recording whether the response passed it.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            if value[10] == "Day of Month":
-                is_valid = value[9].isdigit() and value[8] == "" and is_valid
-                is_valid = (any(day_of_month_value.lower() in response["original"].lower() for day_of_month_value in INT_TO_DAY_OF_MONTH[value[9]]) or value[9] == "") and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return 
+    with start_span(name) as span:
+        passed = check()
+        span.set_attribute("isValid", passed)
+    return passed
+
 
 
-def test_week_of_month_formatting(response: dict) -> None:
+
+# MAIN
+def validate_response(response: dict) -> str:
     """
+    Runs the shared validation rules against a formatted response, stopping at the first failure, and returns the name of the failing rule or None.
+    In a sampled trace, the rules are checked one at a time, each under its own span.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            if value[10] == "Week of Month":
-                is_valid = value[8].isdigit() and value[9] == "" and is_valid
-                is_valid = (any(day_of_week_value.lower() in response["original"].lower() for day_of_week_value in INT_TO_DAY_OF_MONTH[value[8]]) or value[8] == "") and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return
+    with start_span("validate_response") as span:
+        rule_hook = trace_rule if span.traceparent() is not None else None
+        failed_rules = find_failed_rules(response["base"], response["formatted"], early_exit=True, rule_hook=rule_hook)
+        response["isValid"] = response["isValid"] and not failed_rules
+        span.set_attribute("failedRule", failed_rules[0] if failed_rules else None)
+    return failed_rules[0] if failed_rules else None
 
 
-def test_weekly_formatting(response: dict) -> None:
+def validate_formatted_strings(items: list) -> list:
     """
+    Runs the shared validation rules against a batch of already formatted strings, without calling the model.
+    Each item is a `{"base", "formatted"}` object, and one `{"isValid", "failedRules"}` object is returned per item, in order.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            if value[10] == "Weekly" or value[10] == "Every Other Week":
-                is_valid = value[8] == "" and value[9] == "" and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return
+    with start_span("validate_formatted_strings", items=len(items)) as span:
+        failed_rules = find_failed_rules_batch([(item["base"], item["formatted"]) for item in items])
+        span.set_attribute("invalidItems", sum(1 for failed in failed_rules if failed))
+    return [{"isValid": not failed, "failedRules": failed} for failed in failed_rules]
 
 
-def test_call_for_information_formatting(response: dict) -> None:
+def format_and_validate_input_string(case: str) -> dict:
     """
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            if value[10] == "Call for Information":
-                is_valid = len("".join(value[0:7])) == 0 and len("".join(value[8:10])) == 0 and len("".join(value[11:])) == 0 and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return
+    response = format_input_string(case)
+    failed_test = response.pop("failedRule", None) or validate_response(response)
+    if failed_test is not None:
+        VALIDATION_FAILURES.inc(rule=failed_test)
+    return response
 
 
-def test_all_null_values_empty_string(response: dict) -> None:
+def normalize_input_string(case: str) -> dict:
     """
+    Returns the cached response for the canonicalized input string and engine, formatting and validating the input string on a miss.
+    Concurrent misses for the same key wait on a single computation.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            is_valid = value[3] == "" and value[4] == "" and value[5] == "" and value[6] == "" and value[11] == "" and value[12] == "" and value[13] == "" and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return
+    with start_span("normalize_input_string") as span:
+        key = cache_key(case)
+        response = RESULT_CACHE.get(key)
+        span.set_attribute("cacheHit", response is not None)
+        if response is None:
+            response = IN_FLIGHT_REQUESTS.do(key, cache_input_string, key, case, lookup=lambda: RESULT_CACHE.get(key, record=False))
+        return dict(response, base=case)
 
 
-def test_valid_hour_types(response: dict) -> None:
+def cache_input_string(key: tuple, case: str) -> dict:
     """
+    Partial responses are only cached for `PARTIAL_CACHE_TTL_SECONDS`, as the segments they are missing depend on which completions returned first.
     """
-    if response["isValid"] == False:
-        return
-    list_of_entries = response["formatted"].split(";")
-    is_valid = True
-    for value in list_of_entries:
-        value = value.split(",")
-        try:
-            is_valid = value[10] in HOUR_TYPES and is_valid
-        except:
-            is_valid = False
-    response["isValid"] = response["isValid"] and is_valid
-    return
+    response = format_and_validate_input_string(case)
+    RESULT_CACHE.set(key, response, PARTIAL_CACHE_TTL_SECONDS if response.get("partial") else -1)
+    return response
 
 
+def normalize_input_strings(cases: list) -> iter:
+    """
+    Normalizes a batch of input strings concurrently, yielding one response per case as each completes.
+    Duplicate cases share a single computation.
+    """
+    futures = {}
+    for case in cases:
+        if case not in futures:
+            futures[case] = REQUEST_EXECUTOR.submit(bind_context(normalize_input_string), case)
+    counts = Counter(cases)
+    cases_by_future = {future: case for case, future in futures.items()}
+    try:
+        for future in as_completed(cases_by_future):
+            case = cases_by_future[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                response = {"base": case, "formatted": "", "isValid": False, "error": str(e)}
+            for _ in range(counts[case]):
+                yield response
+    except GeneratorExit:
+        # The client disconnected, so the cases not yet started are never normalized
+        [future.cancel() for future in cases_by_future]
+        raise
+
+
+def stream_input_string(case: str) -> iter:
+    """
+    Yields a `(event, data)` pair for each segment of the input string as soon as its completion returns, followed by a final `result` pair.
+    Each `segment` event holds the segment's formatted entry and whether it passes the validation tests on its own.
+    The `result` event holds the same response as `normalize_input_string`, which is cached unless a segment failed.
+    Once a segment fails or the client disconnects, the segments not yet sent upstream are cancelled, and reported as failed.
+    When the upstream admission queue is full, every segment is reported as failed without being queued.
+    """
+    key = cache_key(case)
+    segments = case.split(";")
+    scope = CancelScope(REQUEST_DEADLINE_SECONDS, current_scope())
+    cached_response = RESULT_CACHE.get(key)
+    if cached_response is not None:
+        futures = {}
+        formatted_segments = cached_response["formatted"].split(";")
+        if len(formatted_segments) != len(segments):
+            segments, formatted_segments = [case], [cached_response["formatted"]]
+        completed = [(index, segment, formatted_segment, None) for index, (segment, formatted_segment) in enumerate(zip(segments, formatted_segments))]
+    else:
+        SEGMENTS_PER_REQUEST.observe(len(segments))
+        with scope:
+            format_scoped_segment = bind_context(format_segment)
+        formatted_segments = [""] * len(segments)
+        completed = []
+        try:
+            segment_futures = UPSTREAM_ADMISSION.submit_all([(format_scoped_segment, segment) for segment in segments], CURRENT_CLIENT.get())
+        except AdmissionRejected as e:
+            segment_futures = []
+            completed = [(index, segment, "", str(e)) for index, segment in enumerate(segments)]
+        futures = {future: (index, segment) for index, (future, segment) in enumerate(zip(segment_futures, segments))}
+    has_error = False
+    try:
+        for index, segment, formatted_segment, error in completed or segment_results(futures, scope):
+            formatted_segments[index] = formatted_segment
+            if error is not None and not has_error:
+                scope.cancel(SEGMENT_FAILED)
+                cancel_futures(futures, SEGMENT_FAILED)
+            has_error = has_error or error is not None
+            segment_response = {"index": index, "base": segment, "formatted": formatted_segment, "isValid": error is None}
+            if error is None:
+                validate_response(segment_response)
+            else:
+                segment_response["error"] = error
+            yield "segment", segment_response
+    except GeneratorExit:
+        scope.cancel(CLIENT_DISCONNECTED)
+        cancel_futures(futures, CLIENT_DISCONNECTED)
+        raise
+    if cached_response is not None:
+        yield "result", dict(cached_response, base=case)
+        return
+    response = {"base": case, "formatted": ";".join(formatted_segments), "isValid": not has_error}
+    if not has_error:
+        failed_test = validate_response(response)
+        if failed_test is not None:
+            VALIDATION_FAILURES.inc(rule=failed_test)
+        RESULT_CACHE.set(key, response)
+    yield "result", response
 
 
-# MAIN
-def normalize_input_string(case: str) -> str:
+def segment_results(futures: dict, scope: CancelScope) -> iter:
     """
+    Yields the `(index, segment, formatted segment, error)` of each segment future as it completes.
+    Segments not completed by the scope's deadline are cancelled, and yielded with an error without waiting for them.
     """
-    response = format_input_string(case)
-    validation_tests = [
-        test_day_of_month_formatting,
-        test_week_of_month_formatting,
-        test_weekly_formatting,
-        test_valid_hour_types,
-        test_valid_day_of_week,
-        test_valid_open_closed_hours,
-        test_close_hour_greater_than_open_hour,
-        test_all_null_values_empty_string,
-        test_valid_entry_format,
-        test_call_for_information_formatting,
-    ]
-    [test(response) for test in validation_tests]
-    return response
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=scope.remaining()):
+            pending.discard(future)
+            index, segment = futures[future]
+            try:
+                yield index, segment, future.result(), None
+            except CancelledError:
+                yield index, segment, "", f"Cancelled before being sent upstream ({scope.reason})."
+            except Exception as e:
+                yield index, segment, "", str(e)
+    except TimeoutError:
+        scope.cancel(DEADLINE_EXCEEDED)
+        cancel_futures(pending, DEADLINE_EXCEEDED)
+        for future in sorted(pending, key=lambda future: futures[future][0]):
+            index, segment = futures[future]
+            yield index, segment, "", f"The segment was not formatted within {REQUEST_DEADLINE_SECONDS:g} seconds."
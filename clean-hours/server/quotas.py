@@ -0,0 +1,215 @@
+"""
+This module contains the per-client quotas of the normalizeHours server.
+
+Each client, identified by the `CLIENT_ID_HEADER` request header (or its address), has two token buckets:
+- A request bucket, refilled at `CLIENT_REQUESTS_PER_MINUTE`, charged one token per request.
+- An upstream token bucket, refilled at `CLIENT_TOKENS_PER_MINUTE`, charged the estimated model tokens of each segment sent upstream.
+Each bucket holds up to one minute of its rate, so a client may burst up to its per-minute quota. A rate of 0 disables the bucket.
+
+The buckets are kept in-process, or in the SQLite database at `QUOTA_STORE_PATH` so that every worker process of a pre-fork server shares them.
+The current client is held in a context variable, which `tracing.bind_context` carries into executor threads along with the current span.
+"""
+
+
+# PACKAGE IMPORTS
+import contextvars
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# LOCAL FILE IMPORTS
+from admission import UpstreamUnavailable
+
+
+# MISC CONSTANTS
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER", "X-API-Key")
+CLIENT_REQUESTS_PER_MINUTE = float(os.getenv("CLIENT_REQUESTS_PER_MINUTE", "0"))
+CLIENT_TOKENS_PER_MINUTE = float(os.getenv("CLIENT_TOKENS_PER_MINUTE", "0"))
+QUOTA_STORE_PATH = os.getenv("QUOTA_STORE_PATH", "")
+CHARACTERS_PER_TOKEN = 4
+CURRENT_CLIENT = contextvars.ContextVar("current_client", default="")
+
+
+
+
+# ERRORS
+class ClientQuotaExceeded(UpstreamUnavailable):
+    """
+    Raised when a client has used up one of its quotas.
+    """
+    status = 429
+
+
+
+
+# STORES
+class MemoryBucketStore:
+    """
+    Token buckets kept in the memory of the current process.
+    """
+    def __init__(
+        self,
+    ) -> None:
+        """
+        """
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(
+        self,
+        key: str,
+        amount: float,
+        per_minute: float,
+        require: bool,
+    ) -> tuple:
+        """
+        Refills the bucket and takes `amount` tokens from it, and returns whether they were taken and the tokens left.
+        With `require`, tokens are only taken if the bucket holds enough of them. Otherwise, the bucket may go into debt.
+        """
+        now = time.time()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (per_minute, now))
+            tokens, is_taken = take_tokens(tokens, updated_at, now, amount, per_minute, require)
+            self.buckets[key] = (tokens, now)
+        return is_taken, tokens
+
+
+class SqliteBucketStore:
+    """
+    Token buckets kept in a SQLite database, shared by every process using the same file.
+    """
+    def __init__(
+        self,
+        path: str,
+    ) -> None:
+        """
+        """
+        self.path = path
+        self.local = threading.local()
+
+    def connection(
+        self,
+    ) -> sqlite3.Connection:
+        """
+        Returns this thread's connection, opening it on first use so that connections are never shared across threads or forked processes.
+        """
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self.local.connection.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def take(
+        self,
+        key: str,
+        amount: float,
+        per_minute: float,
+        require: bool,
+    ) -> tuple:
+        """
+        """
+        connection = self.connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (per_minute, now)
+            tokens, is_taken = take_tokens(tokens, updated_at, now, amount, per_minute, require)
+            connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return is_taken, tokens
+
+
+BUCKET_STORE = SqliteBucketStore(QUOTA_STORE_PATH) if QUOTA_STORE_PATH else MemoryBucketStore()
+
+
+
+
+# HELPERS
+def take_tokens(
+    tokens: float,
+    updated_at: float,
+    now: float,
+    amount: float,
+    per_minute: float,
+    require: bool,
+) -> tuple:
+    """
+    Returns the tokens left in a bucket refilled since `updated_at`, after taking `amount` tokens, and whether they were taken.
+    """
+    tokens = min(per_minute, tokens + (now - updated_at) * per_minute / 60)
+    if require and tokens < amount:
+        return tokens, False
+    return tokens - amount, True
+
+
+def seconds_until(
+    tokens: float,
+    amount: float,
+    per_minute: float,
+) -> float:
+    """
+    Returns the seconds until a bucket holding `tokens` tokens holds `amount` tokens.
+    """
+    return max(0.0, (amount - tokens) * 60 / per_minute)
+
+
+def client_id(
+    headers: dict,
+    remote_address: str,
+) -> str:
+    """
+    """
+    return headers.get(CLIENT_ID_HEADER) or remote_address or ""
+
+
+def take_request(
+    client: str,
+    headers: dict,
+) -> None:
+    """
+    Charges one request to the client's request bucket, and adds the rate limit headers of the client's quotas to `headers`.
+    Raises `ClientQuotaExceeded` if the client has no requests left.
+    """
+    if CLIENT_REQUESTS_PER_MINUTE > 0:
+        is_taken, tokens = BUCKET_STORE.take("requests:" + client, 1, CLIENT_REQUESTS_PER_MINUTE, True)
+        headers.update({
+            "X-RateLimit-Limit": str(int(CLIENT_REQUESTS_PER_MINUTE)),
+            "X-RateLimit-Remaining": str(max(0, math.floor(tokens))),
+            "X-RateLimit-Reset": str(math.ceil(seconds_until(tokens, CLIENT_REQUESTS_PER_MINUTE, CLIENT_REQUESTS_PER_MINUTE))),
+        })
+        if not is_taken:
+            raise ClientQuotaExceeded("The client has exceeded its request quota.", seconds_until(tokens, 1, CLIENT_REQUESTS_PER_MINUTE))
+    if CLIENT_TOKENS_PER_MINUTE > 0:
+        _, tokens = BUCKET_STORE.take("tokens:" + client, 0, CLIENT_TOKENS_PER_MINUTE, False)
+        headers.update({
+            "X-TokenLimit-Limit": str(int(CLIENT_TOKENS_PER_MINUTE)),
+            "X-TokenLimit-Remaining": str(max(0, math.floor(tokens))),
+        })
+
+
+def check_tokens(
+) -> None:
+    """
+    Raises `ClientQuotaExceeded` if the current client has used up its upstream token quota.
+    """
+    if CLIENT_TOKENS_PER_MINUTE > 0:
+        _, tokens = BUCKET_STORE.take("tokens:" + CURRENT_CLIENT.get(), 0, CLIENT_TOKENS_PER_MINUTE, False)
+        if tokens <= 0:
+            raise ClientQuotaExceeded("The client has exceeded its upstream token quota.", seconds_until(tokens, 1, CLIENT_TOKENS_PER_MINUTE))
+
+
+def charge_tokens(
+    prompt: str,
+    completion: str,
+) -> None:
+    """
+    Charges the estimated tokens of an upstream prompt and completion to the current client, which may take its bucket into debt.
+    """
+    if CLIENT_TOKENS_PER_MINUTE > 0:
+        BUCKET_STORE.take("tokens:" + CURRENT_CLIENT.get(), math.ceil((len(prompt) + len(completion)) / CHARACTERS_PER_TOKEN), CLIENT_TOKENS_PER_MINUTE, False)
@@ -0,0 +1,239 @@
+"""
+This module contains the in-process result cache used by the normalizeHours function.
+
+The cache is a bounded LRU cache whose entries expire after a TTL.
+Its contents can be snapshotted to a JSON file on shutdown and reloaded on startup, so a restarted server is warm immediately.
+It can also hold a read-only index of pinned entries (see `warmCache.py`), which never expire, are never evicted and are not snapshotted.
+
+Cache misses for the same key that arrive while the first miss is still being computed are coalesced onto that computation by `SingleFlight`.
+"""
+
+
+# PACKAGE IMPORTS
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+
+
+# CACHE
+class ResultCache:
+    """
+    A thread-safe, bounded LRU cache with a TTL on each entry.
+
+    Keys are tuples of strings, and values must be JSON serializable to be snapshotted.
+    """
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+    ) -> None:
+        """
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.pinned = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(
+        self,
+        key: tuple,
+        record: bool = True,
+    ) -> any:
+        """
+        Returns the pinned or cached value for the key, or None if the key is missing or expired.
+        Lookups with `record` set to False are left out of the hit and miss statistics.
+        """
+        with self.lock:
+            value = self.pinned.get(key)
+            if value is not None:
+                self.hits += record
+                return value
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.time():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += record
+                return None
+            self.entries.move_to_end(key)
+            self.hits += record
+            return entry[1]
+
+    def set(
+        self,
+        key: tuple,
+        value: any,
+        ttl_seconds: float = -1,
+    ) -> None:
+        """
+        Caches the value for the key, evicting the least recently used entries once the cache is full.
+        The cache's TTL is used unless `ttl_seconds` is given, with None meaning the entry never expires.
+        """
+        ttl_seconds = self.ttl_seconds if ttl_seconds == -1 else ttl_seconds
+        expires_at = None if ttl_seconds is None else time.time() + ttl_seconds
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pin(
+        self,
+        entries: dict,
+    ) -> int:
+        """
+        Replaces the pinned entries, and returns their number.
+        """
+        with self.lock:
+            self.pinned = dict(entries)
+            return len(self.pinned)
+
+    def stats(
+        self,
+    ) -> dict:
+        """
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "pinnedEntries": len(self.pinned),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def snapshot(
+        self,
+        path: str,
+    ) -> int:
+        """
+        Writes the unexpired entries to a JSON file, merged with any entries already in the file, and returns the number of entries written.
+        Merging keeps the entries of other processes sharing the same snapshot file, which take turns through a lock file where supported.
+        """
+        with open(f"{path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = {tuple(key): (expires_at, value) for key, expires_at, value in read_snapshot(path)}
+            with self.lock:
+                entries.update(self.entries)
+            now = time.time()
+            entries = [[list(key), expires_at, value] for key, (expires_at, value) in entries.items() if expires_at is None or expires_at > now]
+            entries = entries[-self.max_entries:]
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(entries, file)
+            os.replace(temporary_path, path)
+        return len(entries)
+
+    def load(
+        self,
+        path: str,
+    ) -> int:
+        """
+        Loads the unexpired entries of a JSON snapshot into the cache, and returns the number of entries loaded.
+        """
+        now = time.time()
+        entries = [(tuple(key), expires_at, value) for key, expires_at, value in read_snapshot(path) if expires_at is None or expires_at > now]
+        with self.lock:
+            for key, expires_at, value in entries[-self.max_entries:]:
+                self.entries[key] = (expires_at, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return len(entries[-self.max_entries:])
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key onto a single in-flight computation.
+    """
+    def __init__(
+        self,
+    ) -> None:
+        """
+        """
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(
+        self,
+        key: tuple,
+        function: callable,
+        *args: any,
+        lookup: callable = None,
+    ) -> any:
+        """
+        Returns `function(*args)`, waiting on the in-flight call for the key instead if there is one.
+        Exceptions raised by the in-flight call are raised to every waiting caller.
+        A caller that becomes the leader first returns `lookup()` if it is not None, since the previous leader may have just stored the result.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            return future.result()
+        try:
+            result = lookup() if lookup is not None else None
+            if result is None:
+                result = function(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def stats(
+        self,
+    ) -> dict:
+        """
+        """
+        with self.lock:
+            return {
+                "inFlight": len(self.calls),
+                "coalesced": self.coalesced,
+            }
+
+
+
+
+# HELPERS
+def read_snapshot(
+    path: str,
+) -> list:
+    """
+    Returns the `[key, expires_at, value]` entries of a JSON snapshot, or an empty list if the snapshot is missing or unreadable.
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
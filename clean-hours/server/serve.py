@@ -0,0 +1,111 @@
+"""
+Production Server Script
+
+This script serves the normalizeHours Flask app with gunicorn, a pre-fork server, instead of the Flask development server.
+The app, its configuration, the model client and the result cache snapshot are loaded once in the master process before the workers are forked.
+Each worker then resumes the interrupted bulk jobs it can lock, and snapshots its result cache when it exits.
+
+---> OPERATIONAL INSTRUCTIONS <---
+
+Instructions:
+    1) Install the server requirements (`pip install -r requirements.txt`). gunicorn does not run on Windows.
+    2) Run the following command within the terminal: `python serve.py`.
+        a) `SERVER_BIND`, `SERVER_WORKERS`, `SERVER_THREADS`, `SERVER_TIMEOUT` and `SERVER_GRACEFUL_TIMEOUT` configure the server (see the README).
+    3) Send `SIGHUP` to the master process to gracefully replace the workers, reloading the configuration.
+       Because the app is preloaded, code changes need a full restart (or `SIGUSR2` followed by `SIGWINCH` and `SIGQUIT` to the old master).
+    4) Send `SIGTERM` to the master process to shut down gracefully, letting in-flight requests finish within `SERVER_GRACEFUL_TIMEOUT`.
+
+Desired Output:
+    * The app served at `SERVER_BIND` (default http://0.0.0.0:8000).
+"""
+
+
+# PACKAGE IMPORTS
+import os
+from gunicorn.app.base import BaseApplication
+
+# LOCAL FILE IMPORTS
+os.environ["SERVER_PREFORK"] = "1"
+from app import app
+from jobs import resume_jobs
+from normalizeHours import RESULT_CACHE, CACHE_SNAPSHOT_PATH
+
+
+# MISC CONSTANTS
+SERVER_OPTIONS = {
+    "bind": os.getenv("SERVER_BIND", "0.0.0.0:8000"),
+    "workers": int(os.getenv("SERVER_WORKERS", str(2 * (os.cpu_count() or 1) + 1))),
+    "threads": int(os.getenv("SERVER_THREADS", "8")),
+    "worker_class": "gthread",
+    "preload_app": True,
+    "timeout": int(os.getenv("SERVER_TIMEOUT", "120")),
+    "graceful_timeout": int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")),
+    "keepalive": 5,
+    "accesslog": "-",
+}
+
+
+
+
+# HOOKS
+def post_fork(
+    server: any,
+    worker: any,
+) -> None:
+    """
+    Resumes the interrupted bulk jobs in the worker, since threads started before the fork would only run in the master.
+    Every worker tries, and the per-job lock leaves each job to the first worker that takes it.
+    """
+    resume_jobs()
+
+
+def worker_exit(
+    server: any,
+    worker: any,
+) -> None:
+    """
+    Snapshots the worker's result cache, merged with the snapshots of the other workers.
+    """
+    if CACHE_SNAPSHOT_PATH:
+        RESULT_CACHE.snapshot(CACHE_SNAPSHOT_PATH)
+
+
+
+
+# SERVER
+class PreforkServer(BaseApplication):
+    """
+    Runs a preloaded WSGI app with gunicorn, configured from a dictionary instead of the command line.
+    """
+    def __init__(
+        self,
+        application: any,
+        options: dict,
+    ) -> None:
+        """
+        """
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(
+        self,
+    ) -> None:
+        """
+        """
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(
+        self,
+    ) -> any:
+        """
+        """
+        return self.application
+
+
+
+
+# MAIN
+if __name__ == "__main__":
+    PreforkServer(app, dict(SERVER_OPTIONS, post_fork=post_fork, worker_exit=worker_exit)).run()
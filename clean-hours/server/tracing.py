@@ -0,0 +1,287 @@
+"""
+This module contains the request tracing of the normalizeHours server, modelled on OpenTelemetry spans.
+
+Tracing is implemented without any third-party library or collector service.
+A trace is started for each request, continuing the W3C `traceparent` header when the caller sends one, and sampled at `TRACE_SAMPLE_RATE` otherwise.
+Spans are exported as one JSON object per line, to the console (`TRACE_EXPORTER=console`) or to `TRACE_FILE` (`TRACE_EXPORTER=file`).
+
+The current span is held in a context variable. Work submitted to an executor keeps its parent span by being wrapped with `bind_context`,
+and streamed response bodies by being wrapped with `bind_iterator`.
+Unsampled requests only ever see `NOOP_SPAN`, so the overhead of tracing is limited to the sampled requests.
+"""
+
+
+# PACKAGE IMPORTS
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+
+# MISC CONSTANTS
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACEPARENT_REGEX = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+EXPORT_LOCK = threading.Lock()
+
+
+
+
+# SPANS
+class Span:
+    """
+    A timed operation within a trace. Used as a context manager, it is the current span until it ends, and is exported when it ends.
+    """
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: str,
+        attributes: dict,
+    ) -> None:
+        """
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start_time = time.time_ns()
+        self.token = None
+
+    def set_attribute(
+        self,
+        key: str,
+        value: any,
+    ) -> None:
+        """
+        """
+        self.attributes[key] = value
+
+    def traceparent(
+        self,
+    ) -> str:
+        """
+        Returns the W3C `traceparent` header that continues the trace from this span.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def __enter__(
+        self,
+    ) -> "Span":
+        """
+        """
+        self.token = CURRENT_SPAN.set(self)
+        return self
+
+    def __exit__(
+        self,
+        exception_type: type,
+        exception: BaseException,
+        _: any,
+    ) -> None:
+        """
+        """
+        if exception is not None:
+            self.record_exception(exception)
+        self.detach()
+        self.end()
+
+    def record_exception(
+        self,
+        exception: BaseException,
+    ) -> None:
+        """
+        """
+        self.error = f"{type(exception).__name__}: {exception}"
+
+    def detach(
+        self,
+    ) -> None:
+        """
+        Stops the span being the current span, without ending it.
+        """
+        try:
+            CURRENT_SPAN.reset(self.token)
+        except ValueError:
+            CURRENT_SPAN.set(None)
+
+    def end(
+        self,
+    ) -> None:
+        """
+        Ends the span and exports it.
+        """
+        export_span(self, time.time_ns())
+
+
+class NoopSpan:
+    """
+    The span of an unsampled trace, which records and exports nothing.
+    """
+    def set_attribute(
+        self,
+        key: str,
+        value: any,
+    ) -> None:
+        """
+        """
+        return
+
+    def traceparent(
+        self,
+    ) -> str:
+        """
+        """
+        return None
+
+    def __enter__(
+        self,
+    ) -> "NoopSpan":
+        """
+        """
+        return self
+
+    def __exit__(
+        self,
+        *_: any,
+    ) -> None:
+        """
+        """
+        return
+
+    def record_exception(
+        self,
+        exception: BaseException,
+    ) -> None:
+        """
+        """
+        return
+
+    def detach(
+        self,
+    ) -> None:
+        """
+        """
+        return
+
+    def end(
+        self,
+    ) -> None:
+        """
+        """
+        return
+
+
+NOOP_SPAN = NoopSpan()
+
+
+
+
+# HELPERS
+def start_trace(
+    name: str,
+    traceparent: str = None,
+    **attributes: any,
+) -> any:
+    """
+    Returns the root span of a request, continuing the trace of a valid `traceparent` header, and honouring its sampled flag.
+    """
+    if not TRACE_EXPORTER:
+        return NOOP_SPAN
+    match = TRACEPARENT_REGEX.match((traceparent or "").strip().lower())
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        if not int(flags, 16) & 1:
+            return NOOP_SPAN
+        return Span(name, trace_id, parent_id, attributes)
+    if random.random() >= TRACE_SAMPLE_RATE:
+        return NOOP_SPAN
+    return Span(name, random.getrandbits(128).to_bytes(16, "big").hex(), None, attributes)
+
+
+def start_span(
+    name: str,
+    **attributes: any,
+) -> any:
+    """
+    Returns a child span of the current span, or `NOOP_SPAN` if there is no sampled current span.
+    """
+    parent = CURRENT_SPAN.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def current_span(
+) -> any:
+    """
+    """
+    return CURRENT_SPAN.get() or NOOP_SPAN
+
+
+def bind_context(
+    function: callable,
+) -> callable:
+    """
+    Returns a function that runs `function` in a copy of the caller's context, so spans started by an executor thread keep their parent.
+    """
+    context = contextvars.copy_context()
+
+    def run_in_context(*args: any, **kwargs: any) -> any:
+        return context.copy().run(function, *args, **kwargs)
+
+    return run_in_context
+
+
+def bind_iterator(
+    iterator: iter,
+) -> iter:
+    """
+    Returns an iterator that advances `iterator` in a copy of the caller's context, so a streamed response body keeps the request's context.
+    """
+    context = contextvars.copy_context()
+    iterator = iter(iterator)
+
+    def run_in_context() -> iter:
+        while True:
+            try:
+                yield context.run(next, iterator)
+            except StopIteration:
+                return
+
+    return run_in_context()
+
+
+def export_span(
+    span: Span,
+    end_time: int,
+) -> None:
+    """
+    Writes a finished span as one JSON line to the configured exporter.
+    """
+    line = json.dumps({
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id,
+        "name": span.name,
+        "startTimeUnixNano": span.start_time,
+        "endTimeUnixNano": end_time,
+        "durationMs": round((end_time - span.start_time) / 1e6, 3),
+        "attributes": span.attributes,
+        "status": "ERROR" if span.error else "OK",
+        "error": span.error,
+    }, default=str)
+    with EXPORT_LOCK:
+        if TRACE_EXPORTER == "console":
+            print(line, file=sys.stderr, flush=True)
+        elif TRACE_EXPORTER == "file":
+            with open(TRACE_FILE, "a") as file:
+                file.write(line + "\n")
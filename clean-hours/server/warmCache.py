@@ -0,0 +1,206 @@
+"""
+Cache Warming Script
+
+This script rebuilds the `Hours Uncleaned` to formatted hours mappings of historical bulk upload files, from their `_HOURS_CLEANED.csv` outputs.
+Each bulk upload file is paired with the cleaned output next to it (as left in `csvs/` by `clean_hours.py`, or in a job's directory).
+Only the programs whose hours were cleaned (their `Hours Uncleaned` cell is empty in the output) and still pass the shared validation rules are kept.
+
+The mappings are written to a warm index, a JSON file which the server pins into its result cache on startup when listed in `CACHE_WARM_PATHS`.
+Pinned entries never expire and are never evicted, so the most common inputs are served from memory from the first request.
+`CACHE_WARM_PATHS` may also list the historical files themselves, which are then ingested on every startup instead.
+
+---> OPERATIONAL INSTRUCTIONS <---
+
+Instructions:
+    1) Run the following command within the terminal: `python warmCache.py "csvs/*.csv" --output warm_cache.json`.
+        a) Directories, glob patterns and individual files may be passed, for either file of each pair.
+        b) When an input string was cleaned differently over time, the most recently modified cleaned output wins.
+    2) Set `CACHE_WARM_PATHS="warm_cache.json"` and restart the server.
+
+Desired Output:
+    * A warm index holding the validated mappings, most common input strings first, up to `CACHE_WARM_MAX_ENTRIES`.
+"""
+
+
+# PACKAGE IMPORTS
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from collections import Counter
+
+# LOCAL FILE IMPORTS
+from jobs import PROGRAM_ID_COLUMN
+from normalizeHours import cache_key, RESULT_CACHE, UNCLEANED_HOURS_COLUMN
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from hoursValidation import find_failed_rules
+
+
+# MISC CONSTANTS
+CACHE_WARM_PATHS = os.getenv("CACHE_WARM_PATHS", "")
+CACHE_WARM_MAX_ENTRIES = int(os.getenv("CACHE_WARM_MAX_ENTRIES", "100000"))
+CLEANED_SUFFIX = "_HOURS_CLEANED.csv"
+JOB_INPUT_FILE = "input.csv"
+FORMATTED_HOURS_FIELDS = 14
+
+
+
+
+# HELPERS
+def expand_paths(
+    paths: list,
+) -> list:
+    """
+    Returns the files matched by a list of files, directories (searched recursively, so a `jobs` directory may be passed) and glob patterns, without duplicates.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "**", "*.csv"), recursive=True) + glob.glob(os.path.join(path, "*.json")))
+        else:
+            matches = sorted(glob.glob(path)) or [path]
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def find_history_pairs(
+    files: list,
+) -> list:
+    """
+    Returns the `(bulk upload file, cleaned output)` pairs of a list of CSV files, oldest cleaned output first.
+    Either file of a pair may be listed. Files without their other half are skipped.
+    The cleaned output of a job is paired with the job's `input.csv`.
+    """
+    pairs = set()
+    for file in files:
+        if file.endswith(CLEANED_SUFFIX):
+            input_path = file[:-len(CLEANED_SUFFIX)] + ".csv"
+            if not os.path.isfile(input_path):
+                input_path = os.path.join(os.path.dirname(file), JOB_INPUT_FILE)
+            pair = (input_path, file)
+        elif os.path.basename(file) == JOB_INPUT_FILE:
+            pair = (file, next(iter(glob.glob(os.path.join(glob.escape(os.path.dirname(file)), "*" + CLEANED_SUFFIX))), ""))
+        else:
+            pair = (file, file[:-len(".csv")] + CLEANED_SUFFIX)
+        if os.path.isfile(pair[0]) and os.path.isfile(pair[1]):
+            pairs.add(pair)
+    return sorted(pairs, key=lambda pair: os.path.getmtime(pair[1]))
+
+
+def read_csv(
+    path: str,
+) -> tuple:
+    """
+    """
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        rows = list(csv.reader(file))
+    if not rows:
+        return [], []
+    return rows[0], rows[1:]
+
+
+def read_history_mappings(
+    input_path: str,
+    cleaned_path: str,
+) -> list:
+    """
+    Returns the `(input string, formatted hours)` mapping of every program cleaned in a historical pair.
+    The formatted hours of a program are rebuilt from the hour columns of its rows in the cleaned output, one `;` entry per row.
+    """
+    input_header, input_rows = read_csv(input_path)
+    cleaned_header, cleaned_rows = read_csv(cleaned_path)
+    for header in [input_header, cleaned_header]:
+        if PROGRAM_ID_COLUMN not in header or UNCLEANED_HOURS_COLUMN not in header:
+            return []
+    id_index, hours_index = input_header.index(PROGRAM_ID_COLUMN), input_header.index(UNCLEANED_HOURS_COLUMN)
+    cases = {row[id_index]: row[hours_index].strip() for row in input_rows if len(row) > max(id_index, hours_index)}
+
+    # The 14 formatted hour fields are the columns before `Hours Uncleaned`, which is left empty for cleaned programs
+    id_index, hours_index = cleaned_header.index(PROGRAM_ID_COLUMN), cleaned_header.index(UNCLEANED_HOURS_COLUMN)
+    if hours_index < FORMATTED_HOURS_FIELDS:
+        return []
+    entries, uncleaned = {}, set()
+    for row in cleaned_rows:
+        if len(row) <= max(id_index, hours_index):
+            continue
+        if row[hours_index].strip():
+            uncleaned.add(row[id_index])
+        else:
+            entries.setdefault(row[id_index], []).append(",".join(row[hours_index - FORMATTED_HOURS_FIELDS:hours_index]))
+    return [(cases[program_id], ";".join(program_entries)) for program_id, program_entries in entries.items() if program_id in cases and program_id not in uncleaned and cases[program_id]]
+
+
+def read_warm_index(
+    path: str,
+) -> list:
+    """
+    Returns the `[input string, formatted hours, count]` entries of a warm index,
+    or an empty list if it cannot be read or is not a warm index (such as a cache snapshot found in the same directory).
+    """
+    try:
+        with open(path) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return []
+    is_warm_index = isinstance(index, list) and all(
+        isinstance(entry, list) and len(entry) == 3 and isinstance(entry[0], str) and isinstance(entry[1], str) and isinstance(entry[2], int)
+        for entry in index
+    )
+    return index if is_warm_index else []
+
+
+def build_warm_index(
+    paths: list,
+    max_entries: int = CACHE_WARM_MAX_ENTRIES,
+) -> list:
+    """
+    Returns the `[input string, formatted hours, count]` entries of the historical pairs and warm indexes found in `paths`, most common first.
+    Mappings failing the shared validation rules are dropped.
+    """
+    files = expand_paths(paths)
+    counts, formatted = Counter(), {}
+    for path in [file for file in files if file.endswith(".json")]:
+        for case, formatted_case, count in read_warm_index(path):
+            counts[case] += count
+            formatted[case] = formatted_case
+    for input_path, cleaned_path in find_history_pairs([file for file in files if file.endswith(".csv")]):
+        for case, formatted_case in read_history_mappings(input_path, cleaned_path):
+            counts[case] += 1
+            formatted[case] = formatted_case
+    index = [[case, formatted[case], count] for case, count in counts.most_common() if not find_failed_rules(case, formatted[case], early_exit=True)]
+    return index[:max_entries]
+
+
+def warm_cache(
+    paths: list,
+) -> int:
+    """
+    Pins the validated mappings found in `paths` into the result cache, and returns the number of entries pinned.
+    """
+    index = build_warm_index(paths)
+    return RESULT_CACHE.pin({cache_key(case): {"base": case, "formatted": formatted_case, "isValid": True} for case, formatted_case, _ in index})
+
+
+
+
+# MAIN
+if __name__ == "__main__":
+    # Define console parser
+    parser = argparse.ArgumentParser(description="Build a warm index of the result cache from historical bulk upload files and their cleaned outputs")
+    # Add paths argument
+    parser.add_argument("paths", action="store", nargs="+", help="Historical bulk upload files, cleaned outputs, warm indexes, directories or glob patterns")
+    # Add output argument
+    parser.add_argument("--output", action="store", default="warm_cache.json", help="The warm index file to write")
+    # Add max entries argument
+    parser.add_argument("--max-entries", action="store", type=int, default=CACHE_WARM_MAX_ENTRIES, help="The maximum number of input strings kept, most common first")
+    # Console arguments
+    args = parser.parse_args()
+
+    index = build_warm_index(args.paths, args.max_entries)
+    temporary_path = f"{args.output}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(index, file)
+    os.replace(temporary_path, args.output)
+    print(f"Wrote {len(index)} input strings ({sum(count for _, _, count in index)} historical programs) to {args.output}")
@@ -6,9 +6,12 @@ import openai
 import argparse, os, shutil
 import pandas as pd
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langcodes import Language
 from langdetect import detect_langs
 import re
+import json
 
 # LOCAL FILE IMPORTS
 
@@ -19,49 +22,40 @@ from keys import TAGS_KEY as OAI_API
 # MISC CONSTANTS
 LOCATION_COLUMNS = ["Location Name", "Location Headline", "Location Overview", "Location Announcements", "Location Action Links", "Location Tags", "Organization Name", "Organization About Us", "Organization Tags"]
 PROGRAM_COLUMNS = ["Program Name", "Program Announcements", "Program Overview", "Program Service Category", "Food Program Category", "Location Name", "Location Headline", "Location Overview", "Location Announcements", "Location Action Links", "Location Tags"]
-LOCATION_PROMPTS = {
-"Languages Spoken":
-"""
-Given the following information, please determine what languages are spoken at this location. After the location, append the stop character '%%' to the end of the response. 
-
-Input:
-"Location Name: 'Famous Food Pantry', Location Headline: 'NA', Location Overview: 'NA', Location Announcements: 'NA', Location Action Links: 'NA', Location Tags: 'NA', Organization Name: 'Famous Food Network', Organization About Us: 'We make the best food', Organization Tags: 'NA'"
-Output:
-English%%
-Input:
-"Location Name: 'Refugio', Location Headline: 'Refugio anónimo', Location Overview: 'NA', Location Announcements: 'NA', Location Action Links: 'NA', Location Tags: 'NA', Organization Name: 'Refugios para todos', Organization About Us: 'NA', Organization Tags: 'NA'"
-Output:
-Spanish%%
-""",
-"Location Features":
-"""
-Given the following information, please determine what location features from the list below could be available at this location.
+LOCATION_FEATURES = ["Air Conditioning", "Near Public Transit", "Parking Available", "Restroom Available", "Safe Space", "Seating in Waiting Area", "Wheelchair Accessible", "WiFi Available"]
+# The allowed values of each location tag category, or None for languages, which are checked against the language names known to langcodes
+# A new category also needs its values added to the examples of `LOCATION_PROMPT`
+LOCATION_TAG_VOCABULARIES = {
+    "Languages Spoken": None,
+    "Location Features": LOCATION_FEATURES,
+}
+FEATURE_LIST = "\n".join("    - " + feature for feature in LOCATION_FEATURES)
+LOCATION_PROMPT = f"""
+Given the following information, please determine the tags of this location, for each of the categories {", ".join(LOCATION_TAG_VOCABULARIES)}.
+Respond with a JSON object mapping each category to a list of tags, using an empty list when no tag applies.
+Languages Spoken lists the languages spoken at this location.
+Location Features lists the location features from the list below that could be available at this location.
 !!! ONLY USE THE FEATURES LISTED BELOW !!!.
-After the feature, append the stop character '%%' to the end of the response.
- 
+After the JSON object, append the stop character '%%' to the end of the response.
+
 Feature List:
-    - Air Conditioning
-    - Near Public Transit
-    - Parking Available
-    - Restroom Available
-    - Safe Space
-    - Seating in Waiting Area
-    - Wheelchair Accessible
-    - WiFi Available
- 
+{FEATURE_LIST}
+
 Input: "Location Name: 'Famous Food Pantry', Location Headline: 'NA', Location Overview: 'Free Wifi and Public Washrooms', Location Announcements: 'NA', Location Action Links: 'NA', Location Tags: 'NA', Organization Name: 'Famous Food Network', Organization About Us: 'We make the best food', Organization Tags: 'NA'"
-Output: WiFi Available/Restroom Available%%
- 
+Output: {{"Languages Spoken": ["English"], "Location Features": ["WiFi Available", "Restroom Available"]}}%%
+
 Input: "Location Name: 'Refugio', Location Headline: 'Refugio anónimo', Location Overview: 'ramp access', Location Announcements: 'NA', Location Action Links: 'NA', Location Tags: 'NA', Organization Name: 'Refugios para todos', Organization About Us: 'Providing shelter in both english and spanish.', Organization Tags: 'NA'"
-Output: Wheelchair Accessible%%
- 
+Output: {{"Languages Spoken": ["English", "Spanish"], "Location Features": ["Wheelchair Accessible"]}}%%
+
 Input: "Location Name: 'Pantry', Location Headline: 'NA', Location Overview: 'We provide food access to impoverished communities.', Location Announcements: 'NA', Location Action Links: 'NA', Location Tags: 'NA', Organization Name: 'Pantry Network', Organization About Us: 'NA', Organization Tags: 'NA'"
-Output: NA%%
+Output: {{"Languages Spoken": ["English"], "Location Features": []}}%%
 """
-}
 PROGRAM_PROMPTS = {
 
 }
+OAI_REQUEST_INTERVAL = 0.05
+OAI_RATE_LIMIT_LOCK = threading.Lock()
+next_oai_request_time = 0.0
 
 
 
@@ -81,40 +75,102 @@ def create_id_rows_dict(df: pd.DataFrame, primary_key: str, columns: list) -> di
     return id_row_dict
 
 
-def call_oai(prompt: str, case: str) -> str:
+def label_location(case: str) -> str:
+    """
+    Labels each value of a location row with its column, as in the prompt examples.
+    """
+    values = case.split(", ")
+    return ", ".join([LOCATION_COLUMNS[i] + ": '" + values[i] + "'" for i in range(len(values))])
+
+
+def wait_for_rate_limit() -> None:
+    """
+    Blocks until the next OAI call is allowed to start, spacing calls from every thread at least `OAI_REQUEST_INTERVAL` seconds apart.
+    """
+    global next_oai_request_time
+    with OAI_RATE_LIMIT_LOCK:
+        now = time.monotonic()
+        wait_time = next_oai_request_time - now
+        next_oai_request_time = max(now, next_oai_request_time) + OAI_REQUEST_INTERVAL
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+
+def call_oai(prompt: str, case: str, max_tokens: int = 100) -> str:
     """
     """
     openai.api_type = "azure"
     openai.api_base = OAI_API["base"]
     openai.api_version = "2023-09-15-preview"
     openai.api_key = OAI_API["key"]
+    wait_for_rate_limit()
     response = openai.Completion.create(
         engine=OAI_API["engine"],
         prompt=f'{prompt}\nInput: "{case}"\nOutput: ',
         temperature=0.4,
-        max_tokens=100,
+        max_tokens=max_tokens,
         top_p=0.25,
         frequency_penalty=0,
         presence_penalty=0,
         best_of=2,
         stop=["%%"]
     )
-    time.sleep(0.05)
     print(response["choices"][0]["text"].strip())
     return response["choices"][0]["text"].strip()
 
 
-def generate_location_tags(id_locations_dict: dict) -> dict:
+def parse_location_tags(response: str) -> dict:
+    """
+    Parses the JSON object of a location prompt response into the tags of each category, joined by '/', or 'NA' if none apply.
+    Tags outside a category's vocabulary are dropped. The categories of a response that is not a JSON object are left empty (None).
+    """
+    try:
+        tags = json.loads(response[response.find("{"):response.rfind("}") + 1])
+    except ValueError:
+        tags = None
+    if not isinstance(tags, dict):
+        print("\tInvalid OAI Response: " + response)
+        return {category: None for category in LOCATION_TAG_VOCABULARIES}
+    location_tags = {}
+    for category, vocabulary in LOCATION_TAG_VOCABULARIES.items():
+        values = tags.get(category)
+        values = [values] if isinstance(values, str) else values
+        values = [value.strip() for value in values if isinstance(value, str)] if isinstance(values, list) else []
+        if vocabulary is None:
+            values = [canonical_language(value) for value in values]
+        else:
+            allowed = {tag.lower(): tag for tag in vocabulary}
+            values = [allowed.get(value.lower()) for value in values]
+        values = list(dict.fromkeys(value for value in values if value))
+        location_tags[category] = "/".join(values) if values else "NA"
+    return location_tags
+
+
+def canonical_language(name: str) -> str:
+    """
+    Returns the display name of a language name, or None if it is not a known language.
+    """
+    try:
+        return Language.find(name).display_name()
+    except LookupError:
+        return None
+
+
+def generate_location_tags(id_locations_dict: dict, workers: int = 8) -> dict:
     """
+    Calls the location prompt once per location, `workers` calls at a time, tagging every category from a single JSON response.
+    If a call fails, the calls not yet started are cancelled before the error is raised.
     """
-    location_tags_dict = {}
-    for locationID, case in id_locations_dict.items():
-        location_tags_dict[locationID] = {}
-        for prompt_name, prompt in LOCATION_PROMPTS.items():
-            case = case.split(", ")
-            case = ", ".join([LOCATION_COLUMNS[i] + ": '" + case[i] + "'" for i in range(len(case))])
-            response = call_oai(prompt, case)
-            location_tags_dict[locationID][prompt_name + ' [A]'] = response
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(call_oai, LOCATION_PROMPT, label_location(case), 200): locationID for locationID, case in id_locations_dict.items()}
+        location_tags_dict = {locationID: None for locationID in id_locations_dict}
+        try:
+            for future in as_completed(futures):
+                location_tags = parse_location_tags(future.result())
+                location_tags_dict[futures[future]] = {category + ' [A]': tags for category, tags in location_tags.items()}
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
     return location_tags_dict
 
 
@@ -165,6 +221,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Identify the primary contacts from a bulk upload file")
     # Add file argument
     parser.add_argument("file", action="store", help="A bulk upload file")
+    # Add workers argument
+    parser.add_argument("--workers", action="store", type=int, default=8, help="The number of concurrent OAI calls")
     # Console arguments
     args = parser.parse_args()
 
@@ -186,7 +244,7 @@ if __name__ == "__main__":
     
     # Parse Contacts through OAI
     print("Calling OpenAI Fine-Tuned Model...")
-    location_tags_dict = generate_location_tags(id_locations_dict)
+    location_tags_dict = generate_location_tags(id_locations_dict, args.workers)
     print(location_tags_dict)
 
     # Check responses